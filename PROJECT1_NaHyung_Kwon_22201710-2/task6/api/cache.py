@@ -0,0 +1,860 @@
+import redis.asyncio as redis
+from redis.asyncio.client import Pipeline
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import asyncio
+import brotli
+import gzip
+import json
+import math
+import orjson
+import os
+import random
+import time
+
+from metrics import (CACHE_DESERIALIZE_TIME, CACHE_ERRORS, CACHE_EVICTIONS, CACHE_HITS, CACHE_INVALIDATIONS,
+                     CACHE_MISS_LOAD_TIME, CACHE_MISSES, CACHE_PAYLOAD_SIZE, CACHE_SETS, REDIS_COMMAND_TIME,
+                     SERIALIZATION_TIME, key_family)
+
+
+class InstrumentedPipeline(Pipeline):
+    """Pipeline timing WATCH-mode commands singly and queued ones as one round trip"""
+
+    async def immediate_execute_command(self, *args, **options):
+        start_time = time.perf_counter()
+        try:
+            return await super().immediate_execute_command(*args, **options)
+        finally:
+            REDIS_COMMAND_TIME.labels(command=str(args[0]).upper()).observe(time.perf_counter() - start_time)
+
+    async def execute(self, raise_on_error: bool = True):
+        start_time = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            REDIS_COMMAND_TIME.labels(command="PIPELINE").observe(time.perf_counter() - start_time)
+
+
+class InstrumentedRedis(redis.Redis):
+    """Redis client that records the round trip time of every command"""
+
+    async def execute_command(self, *args, **options):
+        start_time = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_COMMAND_TIME.labels(command=str(args[0]).upper()).observe(time.perf_counter() - start_time)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> Pipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+# Redis connection with password from environment
+redis_password = os.getenv('REDIS_PASSWORD')
+redis_client = InstrumentedRedis(host='redis', port=6379, db=0, password=redis_password, decode_responses=True)
+# Same server, for cached response bodies: they leave as bytes, so decoding
+# them to str on every hit would only be undone again
+redis_bytes_client = InstrumentedRedis(host='redis', port=6379, db=0, password=redis_password)
+
+# Probabilistic early refresh (XFetch) strength; 0 turns it off
+EARLY_REFRESH_BETA = float(os.getenv('CACHE_EARLY_REFRESH_BETA', '1.0'))
+# How long one replica may hold the recompute lock for a key
+LOCK_TIMEOUT_SECONDS = float(os.getenv('CACHE_LOCK_TIMEOUT_SECONDS', '5'))
+LOCK_POLL_SECONDS = 0.05
+
+# In-process L1 cache in front of Redis, bounded by payload bytes
+L1_MAX_BYTES = int(os.getenv('CACHE_L1_MAX_BYTES', str(32 * 1024 * 1024)))
+L1_MAX_TTL_SECONDS = float(os.getenv('CACHE_L1_MAX_TTL_SECONDS', '60'))
+# Response compression; bodies below COMPRESS_MIN_BYTES are sent as-is
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '5'))
+# Replicas tell each other which keys to drop from their L1 on this channel
+INVALIDATION_CHANNEL = "cache:invalidate"
+# Tagged entries: tag:<tag> is the set of keys carrying that tag, and
+# tag:index the set of tags in use, so a clear can find every tagged key
+TAG_PREFIX = "tag:"
+TAG_INDEX_KEY = "tag:index"
+
+# Loads currently running in this process, keyed by cache key
+_inflight: Dict[str, asyncio.Future] = {}
+# Compressions running in a thread, keyed by (cache key, encoding, payload id)
+_compressing: Dict[Tuple[str, str, int], asyncio.Future] = {}
+_listener_task: Optional[asyncio.Task] = None
+# This process's copy of the roster version (see get_roster_version), and a
+# count of how often it was dropped, so a read racing a drop isn't kept
+_roster_version: Optional[Tuple[str, float]] = None
+_roster_version_expires = 0.0
+_roster_version_drops = 0
+
+
+def compress(payload: bytes, encoding: str) -> bytes:
+    """Encode a response body as Content-Encoding br or gzip"""
+    with SERIALIZATION_TIME.labels(kind=f"compress_{encoding}").time():
+        if encoding == "br":
+            return brotli.compress(payload, quality=BROTLI_QUALITY)
+        return gzip.compress(payload, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class LRUCache:
+    """Least-recently-used cache of response bodies with a byte budget"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        # key -> [payload, size, expires_at, filled_at, {encoding: compressed payload}]
+        self._entries = OrderedDict()
+
+    def get(self, key: str) -> Optional[Tuple[bytes, float, float]]:
+        """Return (payload, expires_at, filled_at) for a live entry, or None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        payload, _, expires_at, filled_at, _ = entry
+        if expires_at <= time.time():
+            self.delete(key)
+            return None
+        self._entries.move_to_end(key)
+        return payload, expires_at, filled_at
+
+    def set(self, key: str, payload: bytes, ttl: float, filled_at: Optional[float] = None):
+        """Store payload for ttl seconds; filled_at is when its source copy was built"""
+        self.delete(key)
+        size = len(payload)
+        if size > self.max_bytes or ttl <= 0:
+            return
+        now = time.time()
+        self._entries[key] = [payload, size, now + ttl, filled_at or now, {}]
+        self.size += size
+        CACHE_SETS.labels(family=key_family(key), tier="memory").inc()
+        self._evict()
+
+    def variant(self, key: str, payload: bytes, encoding: str) -> Optional[bytes]:
+        """payload compressed with encoding, if it was kept for the cached copy"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] is not payload:
+            return None
+        return entry[4].get(encoding)
+
+    def set_variant(self, key: str, payload: bytes, encoding: str, compressed: bytes):
+        """Keep a compressed body next to its entry, so it goes away with it.
+
+        Nothing is kept if payload isn't (or is no longer) the cached copy.
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] is not payload or encoding in entry[4]:
+            return
+        entry[4][encoding] = compressed
+        entry[1] += len(compressed)
+        self.size += len(compressed)
+        self._entries.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        # Evict least recently used entries until we fit the budget again
+        while self.size > self.max_bytes:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self.size -= evicted[1]
+            CACHE_EVICTIONS.labels(family=key_family(evicted_key)).inc()
+
+    def delete(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+
+l1_cache = LRUCache(L1_MAX_BYTES)
+
+
+async def compressed_variant(key: str, payload: bytes, encoding: str) -> bytes:
+    """payload compressed with encoding, computed once per cached copy.
+
+    Compressing a large roster takes long enough to stall every other
+    request, so it runs in a thread, and concurrent requests for the same
+    body share one run.
+    """
+    compressed = l1_cache.variant(key, payload, encoding)
+    if compressed is not None:
+        return compressed
+    # The running thread holds payload, so its id can't be reused meanwhile
+    flight = (key, encoding, id(payload))
+    future = _compressing.get(flight)
+    if future is None:
+        future = asyncio.ensure_future(asyncio.to_thread(compress, payload, encoding))
+        _compressing[flight] = future
+        future.add_done_callback(lambda _: _compressing.pop(flight, None))
+    # shield() so one cancelled request doesn't abort the run others await
+    compressed = await asyncio.shield(future)
+    l1_cache.set_variant(key, payload, encoding, compressed)
+    return compressed
+
+
+async def connect():
+    """Check Redis on startup and disable caching if it is unreachable"""
+    global redis_client, redis_bytes_client, _listener_task
+    try:
+        # Test the connection
+        await redis_client.ping()
+        await redis_bytes_client.ping()
+        print("Redis connection successful")
+    except Exception as e:
+        print(f"Redis connection failed: {e}")
+        redis_client = None
+        redis_bytes_client = None
+        return
+    await _init_roster_version()
+    _listener_task = asyncio.create_task(_listen_for_invalidations())
+
+
+async def close():
+    """Stop the invalidation listener on shutdown"""
+    if _listener_task:
+        _listener_task.cancel()
+
+
+async def _listen_for_invalidations():
+    """Drop keys from this replica's L1 whenever any replica invalidates them"""
+    while True:
+        try:
+            pubsub = redis_client.pubsub()
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Anything cached before we were subscribed may have missed a message
+            l1_cache.clear()
+            _forget_roster_version()
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                keys = json.loads(message["data"])
+                if "*" in keys:
+                    l1_cache.clear()
+                if "*" in keys or ROSTER_VERSION_KEY in keys:
+                    _forget_roster_version()
+                for key in keys:
+                    l1_cache.delete(key)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Redis invalidation listener failed: {e}")
+            l1_cache.clear()
+            _forget_roster_version()
+            await asyncio.sleep(1)
+
+
+async def invalidate(*keys: str, clear_all: bool = False) -> int:
+    """Delete keys from Redis and from the L1 cache of every replica.
+
+    Returns how many keys Redis actually removed. clear_all additionally
+    empties every L1 cache, for entries whose keys we don't track. Each
+    key's generation is bumped so a load already in flight won't write its
+    now stale result back.
+    """
+    for key in keys:
+        l1_cache.delete(key)
+        CACHE_INVALIDATIONS.labels(family=key_family(key)).inc()
+    if clear_all:
+        l1_cache.clear()
+    if not redis_client:
+        return 0
+
+    message = list(keys) + (["*"] if clear_all else [])
+    pipe = redis_client.pipeline()
+    if keys:
+        pipe.delete(*keys)
+    for key in keys:
+        pipe.incr(f"{key}:generation")
+    pipe.publish(INVALIDATION_CHANNEL, json.dumps(message))
+    results = await pipe.execute()
+    return results[0] if keys else 0
+
+
+def module_tag(module_code: Optional[str]) -> str:
+    """Tag for entries covering one module, or module:* for entries spanning them all"""
+    return f"module:{module_code or '*'}"
+
+
+async def invalidate_tags(*tags: str) -> int:
+    """Drop every entry carrying any of tags; returns how many keys were removed.
+
+    Each tag's generation is bumped too, so an entry still being loaded
+    under that tag is not stored when its load finishes.
+    """
+    if not redis_client or not tags:
+        return 0
+    pipe = redis_client.pipeline(transaction=True)
+    for tag in tags:
+        pipe.smembers(TAG_PREFIX + tag)
+        pipe.delete(TAG_PREFIX + tag)
+        pipe.incr(f"{TAG_PREFIX}{tag}:generation")
+    results = await pipe.execute()
+    keys = set().union(*results[0::3])
+    if not keys:
+        return 0
+    return await invalidate(*sorted(keys))
+
+
+async def invalidate_all_tags() -> int:
+    """Drop every tagged entry, whatever its tags"""
+    if not redis_client:
+        return 0
+    return await invalidate_tags(*await redis_client.smembers(TAG_INDEX_KEY))
+
+
+def _queue_tagging(pipe, key: str, ttl: int, tags: Iterable[str]):
+    """Queue the writes that record key under each of its tags"""
+    for tag in tags:
+        pipe.sadd(TAG_PREFIX + tag, key)
+        # A tag set lives as long as its longest-lived key: set if new, else only extend
+        pipe.expire(TAG_PREFIX + tag, ttl, nx=True)
+        pipe.expire(TAG_PREFIX + tag, ttl, gt=True)
+        pipe.sadd(TAG_INDEX_KEY, tag)
+
+
+async def fetch_string(key: str) -> Tuple[Optional[bytes], int, Optional[bytes]]:
+    """Read a plain JSON string entry: (payload, ttl_left, load_seconds)"""
+    pipe = redis_bytes_client.pipeline()
+    pipe.get(key)
+    pipe.ttl(key)
+    pipe.get(f"{key}:delta")
+    cached, ttl_left, delta = await pipe.execute()
+    return cached or None, ttl_left, delta
+
+
+async def store_string(pipe, key: str, ttl: int, value: Any, payload: bytes, delta: float):
+    """Store a plain JSON string entry.
+
+    Like every store, this gets a pipeline still in WATCH (immediate) mode,
+    may read from it, and must call pipe.multi() before queueing writes.
+    """
+    pipe.multi()
+    pipe.setex(key, ttl, payload)
+    # Remember how long the recompute took for early refresh
+    pipe.setex(f"{key}:delta", ttl, delta)
+
+
+async def _load_and_store(key: str, ttl: int, loader: Callable[[], Awaitable[Any]],
+                          fetch: Callable, store: Callable, tags: Sequence[str] = ()) -> Tuple[bytes, str]:
+    """Run loader() once across all replicas and write the result to Redis.
+
+    Returns the serialized JSON body and where it came from: "database" if
+    we ran the loader, "redis" if another replica filled the key while we
+    waited. Either way the body is also kept in the L1 cache.
+    """
+    family = key_family(key)
+    if not redis_client:
+        value = await loader()
+        with SERIALIZATION_TIME.labels(kind="cache_fill").time():
+            payload = orjson.dumps(value)
+        l1_cache.set(key, payload, min(ttl, L1_MAX_TTL_SECONDS))
+        return payload, "database"
+
+    lock = redis_client.lock(f"lock:{key}", timeout=LOCK_TIMEOUT_SECONDS, blocking=False)
+    acquired = False
+    try:
+        acquired = await lock.acquire()
+    except Exception as e:
+        CACHE_ERRORS.labels(family=family, operation="lock").inc()
+        print(f"Redis lock failed: {e}")
+
+    if not acquired:
+        # Another replica is recomputing; wait for its result instead of
+        # running the same query, but never longer than its lock can live
+        deadline = time.time() + LOCK_TIMEOUT_SECONDS
+        while time.time() < deadline:
+            await asyncio.sleep(LOCK_POLL_SECONDS)
+            try:
+                cached, _, _ = await fetch(key)
+            except Exception as e:
+                CACHE_ERRORS.labels(family=family, operation="get").inc()
+                print(f"Redis get failed: {e}")
+                break
+            if cached:
+                l1_cache.set(key, cached, min(ttl, L1_MAX_TTL_SECONDS))
+                return cached, "redis"
+
+    # Invalidating the key itself or any of its tags bumps one of these
+    generation_keys = [f"{key}:generation"] + [f"{TAG_PREFIX}{tag}:generation" for tag in tags]
+    try:
+        generation = None
+        try:
+            generation = await redis_client.mget(generation_keys)
+        except Exception as e:
+            CACHE_ERRORS.labels(family=family, operation="get").inc()
+            print(f"Redis get failed: {e}")
+
+        start_time = time.time()
+        value = await loader()
+        delta = time.time() - start_time
+        CACHE_MISS_LOAD_TIME.labels(family=family).observe(delta)
+        # The only serialization this value ever goes through
+        with SERIALIZATION_TIME.labels(kind="cache_fill").time():
+            payload = orjson.dumps(value)
+        try:
+            async with redis_client.pipeline(transaction=True) as pipe:
+                # A write that lands while we query makes our result stale;
+                # WATCH turns that into a skipped store instead of bad data
+                await pipe.watch(*generation_keys)
+                if await pipe.mget(generation_keys) == generation:
+                    await store(pipe, key, ttl, value, payload, delta)
+                    _queue_tagging(pipe, key, ttl, tags)
+                    await pipe.execute()
+                    l1_cache.set(key, payload, min(ttl, L1_MAX_TTL_SECONDS))
+                    CACHE_SETS.labels(family=family, tier="redis").inc()
+                    CACHE_PAYLOAD_SIZE.labels(family=family).observe(len(payload))
+        except redis.WatchError:
+            pass
+        except Exception as e:
+            CACHE_ERRORS.labels(family=family, operation="set").inc()
+            print(f"Redis setex failed: {e}")
+        return payload, "database"
+    finally:
+        if acquired:
+            try:
+                await lock.release()
+            except Exception as e:
+                CACHE_ERRORS.labels(family=family, operation="unlock").inc()
+                print(f"Redis lock release failed: {e}")
+
+
+def _single_flight(key: str, ttl: int, loader: Callable[[], Awaitable[Any]],
+                   fetch: Callable, store: Callable, tags: Sequence[str] = ()) -> asyncio.Future:
+    """Share one in-progress load of key between every caller in this process"""
+    future = _inflight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(_load_and_store(key, ttl, loader, fetch, store, tags))
+        _inflight[key] = future
+
+        def forget(done: asyncio.Future):
+            _inflight.pop(key, None)
+            # Background refreshes have nobody awaiting them, so log here
+            if not done.cancelled() and done.exception():
+                print(f"Cache load for {key} failed: {done.exception()}")
+
+        future.add_done_callback(forget)
+    return future
+
+
+async def get_or_load(key: str, ttl: int, loader: Callable[[], Awaitable[Any]],
+                      fetch: Callable = fetch_string,
+                      store: Callable = store_string,
+                      tags: Sequence[str] = ()) -> Tuple[bytes, Dict[str, Any]]:
+    """Return the JSON body for key, loading it through loader() on a miss.
+
+    Bodies are cached already serialized, so a hit is handed back as bytes
+    without being parsed or re-encoded.
+
+    Lookups go to the in-process L1 first, then Redis (read with fetch and
+    written with store, a plain JSON string by default). Concurrent misses
+    for the same key wait on a single load, so a cold or expired key costs
+    one database query no matter how many requests hit it. While the key
+    is still warm, a hit may trigger a background refresh with probability
+    rising as expiry nears (XFetch), so hot keys rarely expire.
+
+    tags name what the entry depends on (see module_tag); invalidate_tags()
+    drops it when any of them changes.
+    """
+    family = key_family(key)
+    local = l1_cache.get(key)
+    if local is not None:
+        CACHE_HITS.labels(family=family, tier="memory").inc()
+        payload, expires_at, filled_at = local
+        now = time.time()
+        return payload, {
+            "status": "hit",
+            "source": "memory",
+            "ttl_seconds": int(expires_at - now),
+            "cache_age_seconds": int(now - filled_at)
+        }
+
+    if redis_client:
+        try:
+            cached, ttl_left, delta = await fetch(key)
+        except Exception as e:
+            CACHE_ERRORS.labels(family=family, operation="get").inc()
+            print(f"Redis get failed: {e}")
+            cached = None
+
+        if cached:
+            CACHE_HITS.labels(family=family, tier="redis").inc()
+            CACHE_PAYLOAD_SIZE.labels(family=family).observe(len(cached))
+            if EARLY_REFRESH_BETA > 0 and delta and ttl_left > 0:
+                if -float(delta) * EARLY_REFRESH_BETA * math.log(1.0 - random.random()) >= ttl_left:
+                    _single_flight(key, ttl, loader, fetch, store, tags)
+            # L1 never outlives the Redis copy it was filled from
+            l1_cache.set(key, cached, min(ttl_left, L1_MAX_TTL_SECONDS),
+                         filled_at=time.time() - max(ttl - ttl_left, 0))
+            return cached, {
+                "status": "hit",
+                "source": "redis",
+                "ttl_seconds": ttl_left,
+                "cache_age_seconds": ttl - ttl_left if ttl_left > 0 else None
+            }
+
+    CACHE_MISSES.labels(family=family).inc()
+    # shield() so one cancelled request doesn't abort the load others await
+    payload, source = await asyncio.shield(_single_flight(key, ttl, loader, fetch, store, tags))
+    return payload, {
+        "status": "miss" if source == "database" else "hit",
+        "source": source,
+        "ttl_seconds": ttl,
+        "cache_age_seconds": 0
+    }
+
+
+# Write-through copy of the students table. Rows live in a sorted set scored
+# by student_id (so ZRANGE returns them in roster order) and every module_code
+# has a set of its student_ids. Writes patch these in place; the built marker
+# only exists while the copy is complete, and its TTL bounds drift from
+# writes that bypass the API.
+ROSTER_KEY = "students:all"
+ROSTER_TTL = int(os.getenv('CACHE_ROSTER_TTL_SECONDS', '120'))
+ROSTER_ZSET_KEY = "students:by_id"
+ROSTER_MODULES_KEY = "students:modules"
+ROSTER_MODULE_PREFIX = "students:module:"
+ROSTER_BUILT_KEY = "students:by_id:built"
+# Hash with the roster's data version, used for ETag / Last-Modified. The
+# epoch is set once per Redis lifetime so a flushed counter can't reissue
+# a version a client has already seen.
+ROSTER_VERSION_KEY = "students:version"
+
+
+def _roster_member(student: Dict[str, Any]) -> str:
+    return orjson.dumps({
+        "student_id": student["student_id"],
+        "first_name": student["first_name"],
+        "last_name": student["last_name"],
+        "module_code": student["module_code"]
+    }).decode()
+
+
+# The sorted set outlives the built marker, so only read it while the marker
+# exists; one script, so a clear can't land between the check and the read
+FETCH_ROSTER_SCRIPT = """
+local delta = redis.call('GET', KEYS[1])
+if not delta then
+    return {}
+end
+return {delta, redis.call('TTL', KEYS[1]), redis.call('ZRANGE', KEYS[2], 0, -1)}
+"""
+
+
+async def fetch_roster(key: str) -> Tuple[Optional[bytes], int, Optional[bytes]]:
+    """Reassemble the roster JSON from the sorted set, if the copy is complete"""
+    script = redis_bytes_client.register_script(FETCH_ROSTER_SCRIPT)
+    reply = await script(keys=[ROSTER_BUILT_KEY, ROSTER_ZSET_KEY])
+    if not reply:
+        return None, -2, None
+    delta, ttl_left, members = reply
+    # Members are already JSON objects, so joining them is the whole body
+    with CACHE_DESERIALIZE_TIME.labels(family=key_family(key)).time():
+        payload = b"[" + b",".join(members) + b"]"
+    return payload, ttl_left, delta
+
+
+async def store_roster(pipe, key: str, ttl: int, value: List[Dict[str, Any]], payload: bytes, delta: float):
+    """Replace the whole roster copy, dropping module sets no longer in use"""
+    old_modules = await pipe.smembers(ROSTER_MODULES_KEY)
+    pipe.multi()
+    pipe.delete(ROSTER_ZSET_KEY, ROSTER_MODULES_KEY, *[ROSTER_MODULE_PREFIX + m for m in old_modules])
+    modules = {}
+    for student in value:
+        modules.setdefault(student["module_code"], []).append(student["student_id"])
+    for module_code, ids in modules.items():
+        pipe.sadd(ROSTER_MODULE_PREFIX + module_code, *ids)
+    if value:
+        pipe.zadd(ROSTER_ZSET_KEY, {_roster_member(s): s["student_id"] for s in value})
+        pipe.sadd(ROSTER_MODULES_KEY, *modules)
+    pipe.setex(ROSTER_BUILT_KEY, ttl, delta)
+
+
+async def get_roster(loader: Callable[[], Awaitable[List[Dict[str, Any]]]]) -> Tuple[bytes, Dict[str, Any]]:
+    """Return every student as a JSON body, from L1, the Redis copy, or loader()"""
+    return await get_or_load(ROSTER_KEY, ROSTER_TTL, loader, fetch=fetch_roster, store=store_roster)
+
+
+async def patch_roster(students: List[Dict[str, Any]]):
+    """Write new students through to the Redis copy instead of dropping it"""
+    l1_cache.delete(ROSTER_KEY)
+    if not redis_client or not students:
+        return
+
+    pipe = redis_client.pipeline(transaction=True)
+    # Bumping the generation stops an in-flight rebuild from overwriting us
+    pipe.incr(f"{ROSTER_KEY}:generation")
+    _queue_version_bump(pipe)
+    for student in students:
+        pipe.zremrangebyscore(ROSTER_ZSET_KEY, student["student_id"], student["student_id"])
+        pipe.zadd(ROSTER_ZSET_KEY, {_roster_member(student): student["student_id"]})
+        pipe.sadd(ROSTER_MODULE_PREFIX + student["module_code"], student["student_id"])
+        pipe.sadd(ROSTER_MODULES_KEY, student["module_code"])
+    pipe.publish(INVALIDATION_CHANNEL, json.dumps([ROSTER_KEY]))
+    await pipe.execute()
+    _forget_roster_version()
+    CACHE_SETS.labels(family=key_family(ROSTER_KEY), tier="redis").inc()
+
+
+async def remove_from_roster(student_ids: Sequence[int], module_codes: Iterable[str]):
+    """Take students out of the Redis copy, e.g. after a delete or before re-adding an update"""
+    l1_cache.delete(ROSTER_KEY)
+    if not redis_client or not student_ids:
+        return
+
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.incr(f"{ROSTER_KEY}:generation")
+    _queue_version_bump(pipe)
+    for student_id in student_ids:
+        pipe.zremrangebyscore(ROSTER_ZSET_KEY, student_id, student_id)
+    for module_code in module_codes:
+        pipe.srem(ROSTER_MODULE_PREFIX + module_code, *student_ids)
+    pipe.publish(INVALIDATION_CHANNEL, json.dumps([ROSTER_KEY]))
+    await pipe.execute()
+    _forget_roster_version()
+    CACHE_INVALIDATIONS.labels(family=key_family(ROSTER_KEY)).inc()
+
+
+async def clear_roster() -> bool:
+    """Drop the whole Redis roster copy; returns whether one was cached"""
+    l1_cache.delete(ROSTER_KEY)
+    if not redis_client:
+        return False
+
+    async with redis_client.pipeline(transaction=True) as pipe:
+        await pipe.watch(ROSTER_MODULES_KEY)
+        modules = await pipe.smembers(ROSTER_MODULES_KEY)
+        pipe.multi()
+        pipe.exists(ROSTER_BUILT_KEY)
+        pipe.delete(ROSTER_BUILT_KEY, ROSTER_ZSET_KEY, ROSTER_MODULES_KEY,
+                    *[ROSTER_MODULE_PREFIX + m for m in modules])
+        pipe.incr(f"{ROSTER_KEY}:generation")
+        pipe.publish(INVALIDATION_CHANNEL, json.dumps([ROSTER_KEY]))
+        results = await pipe.execute()
+    CACHE_INVALIDATIONS.labels(family=key_family(ROSTER_KEY)).inc()
+    return results[0] > 0
+
+
+async def roster_generation() -> Optional[str]:
+    """The roster copy's generation, to read before loading rows for verify_roster or rebuild_roster"""
+    if not redis_client:
+        return None
+    return await redis_client.get(f"{ROSTER_KEY}:generation")
+
+
+async def verify_roster(students: List[Dict[str, Any]], generation: Optional[str],
+                        repair: bool = False) -> Dict[str, Any]:
+    """Compare the Redis roster copy against rows read from the database.
+
+    generation is roster_generation() from before the rows were read. If a
+    write patched the copy since, the rows are older than the copy and
+    differences are expected, so the report sets "changed" and nothing is
+    repaired. Otherwise, with repair=True any drift is fixed by rebuilding
+    the copy from those rows. Returns a report of what differed.
+    """
+    report = {"cached": False, "missing": [], "extra": [], "mismatched": [], "modules": [],
+              "changed": False, "repaired": False}
+    if not redis_client:
+        return report
+
+    pipe = redis_client.pipeline()
+    pipe.exists(ROSTER_BUILT_KEY)
+    pipe.zrange(ROSTER_ZSET_KEY, 0, -1, withscores=True)
+    pipe.smembers(ROSTER_MODULES_KEY)
+    pipe.get(f"{ROSTER_KEY}:generation")
+    built, members, modules, current = await pipe.execute()
+    report["cached"] = built > 0
+    report["changed"] = current != generation
+    if not report["cached"]:
+        return report
+
+    expected = {s["student_id"]: _roster_member(s) for s in students}
+    actual = {int(score): member for member, score in members}
+    report["missing"] = sorted(set(expected) - set(actual))
+    report["extra"] = sorted(set(actual) - set(expected))
+    report["mismatched"] = sorted(i for i in set(expected) & set(actual) if expected[i] != actual[i])
+
+    expected_modules = {}
+    for student in students:
+        expected_modules.setdefault(student["module_code"], set()).add(student["student_id"])
+    pipe = redis_client.pipeline()
+    checked = sorted(set(expected_modules) | set(modules))
+    for module_code in checked:
+        pipe.smembers(ROSTER_MODULE_PREFIX + module_code)
+    for module_code, ids in zip(checked, await pipe.execute()):
+        if {int(i) for i in ids} != expected_modules.get(module_code, set()):
+            report["modules"].append(module_code)
+
+    drifted = report["missing"] or report["extra"] or report["mismatched"] or report["modules"]
+    if repair and drifted and not report["changed"]:
+        report["repaired"] = await rebuild_roster(students, generation)
+    return report
+
+
+async def rebuild_roster(students: List[Dict[str, Any]], generation: Optional[str]) -> bool:
+    """Replace the Redis roster copy with the given rows.
+
+    generation is roster_generation() from before the rows were read; if
+    the copy was patched since, the rows would drop that write, so nothing
+    is stored and False is returned for the caller to retry later.
+    """
+    l1_cache.delete(ROSTER_KEY)
+    if not redis_client:
+        return False
+
+    generation_key = f"{ROSTER_KEY}:generation"
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            # Same guard as _load_and_store: a write between our read and
+            # this store bumps the generation and aborts the transaction
+            await pipe.watch(ROSTER_MODULES_KEY, generation_key)
+            if await pipe.get(generation_key) != generation:
+                return False
+            await store_roster(pipe, ROSTER_KEY, ROSTER_TTL, students, orjson.dumps(students), 0)
+            pipe.incr(generation_key)
+            # A rebuild may have picked up writes that bypassed the API
+            _queue_version_bump(pipe)
+            pipe.publish(INVALIDATION_CHANNEL, json.dumps([ROSTER_KEY]))
+            await pipe.execute()
+    except redis.WatchError:
+        return False
+    _forget_roster_version()
+    CACHE_SETS.labels(family=key_family(ROSTER_KEY), tier="redis").inc()
+    return True
+
+
+async def bump_roster_version():
+    """Mark the roster data as changed without touching any cached copy"""
+    if not redis_client:
+        return
+    pipe = redis_client.pipeline(transaction=True)
+    _queue_version_bump(pipe)
+    await pipe.execute()
+    _forget_roster_version()
+
+
+def _queue_version_bump(pipe):
+    """Queue the writes that mark the roster data as changed, and tell every replica"""
+    now = time.time()
+    pipe.hsetnx(ROSTER_VERSION_KEY, "epoch", int(now * 1000))
+    pipe.hincrby(ROSTER_VERSION_KEY, "version", 1)
+    pipe.hset(ROSTER_VERSION_KEY, "modified", now)
+    pipe.publish(INVALIDATION_CHANNEL, json.dumps([ROSTER_VERSION_KEY]))
+
+
+def _forget_roster_version():
+    """Drop this process's copy of the version; the next read fetches it again"""
+    global _roster_version, _roster_version_drops
+    _roster_version = None
+    _roster_version_drops += 1
+
+
+async def _init_roster_version():
+    """Create the version hash if Redis doesn't have one (first start or after a flush)"""
+    now = time.time()
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hsetnx(ROSTER_VERSION_KEY, "epoch", int(now * 1000))
+    pipe.hsetnx(ROSTER_VERSION_KEY, "modified", now)
+    await pipe.execute()
+
+
+async def get_roster_version() -> Optional[Tuple[str, float]]:
+    """Return (version, last_modified) for the roster, or None without Redis.
+
+    Served from memory: every bump publishes on INVALIDATION_CHANNEL, which
+    drops the copy in each replica, so Redis is only read after a change
+    (or after L1_MAX_TTL_SECONDS, like an L1 entry, in case a message was lost).
+    """
+    global _roster_version, _roster_version_expires
+    if not redis_client:
+        return None
+    if _roster_version is not None and _roster_version_expires > time.time():
+        return _roster_version
+    drops = _roster_version_drops
+    try:
+        epoch, version, modified = await redis_client.hmget(ROSTER_VERSION_KEY, "epoch", "version", "modified")
+        if epoch is None or modified is None:
+            await _init_roster_version()
+            epoch, version, modified = await redis_client.hmget(ROSTER_VERSION_KEY, "epoch", "version", "modified")
+    except Exception as e:
+        print(f"Redis version read failed: {e}")
+        return None
+    current = f"{epoch}-{version or 0}", float(modified)
+    # Keep it only while the listener runs and no bump arrived while we read
+    if drops == _roster_version_drops and _listener_task and not _listener_task.done():
+        _roster_version = current
+        _roster_version_expires = time.time() + L1_MAX_TTL_SECONDS
+    return current
+
+
+# Per-module enrollment counts, mirroring the module_stats table. The
+# built field marks a complete copy; HINCRBY on a missing hash would
+# otherwise leave a partial one that looks valid.
+MODULE_COUNTS_KEY = "students:module_counts"
+MODULE_COUNTS_BUILT_FIELD = "__built__"
+
+
+async def get_module_counts(loader: Callable[[], Awaitable[Dict[str, int]]]) -> Tuple[Dict[str, int], str]:
+    """Return (module_code -> student count, source), from Redis or loader()"""
+    family = key_family(MODULE_COUNTS_KEY)
+    if not redis_client:
+        return await loader(), "database"
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            # Any increment landing while the database is read touches the
+            # key and aborts the store, so counts already read can't hide it
+            await pipe.watch(MODULE_COUNTS_KEY)
+            counts = await pipe.hgetall(MODULE_COUNTS_KEY)
+            if counts.pop(MODULE_COUNTS_BUILT_FIELD, None) is not None:
+                CACHE_HITS.labels(family=family, tier="redis").inc()
+                return {module_code: int(count) for module_code, count in counts.items()}, "redis"
+            CACHE_MISSES.labels(family=family).inc()
+            with CACHE_MISS_LOAD_TIME.labels(family=family).time():
+                counts = await loader()
+            pipe.multi()
+            pipe.delete(MODULE_COUNTS_KEY)
+            pipe.hset(MODULE_COUNTS_KEY, mapping={**counts, MODULE_COUNTS_BUILT_FIELD: 1})
+            await pipe.execute()
+            CACHE_SETS.labels(family=family, tier="redis").inc()
+            return counts, "database"
+    except redis.WatchError:
+        return counts, "database"
+    except Exception as e:
+        CACHE_ERRORS.labels(family=family, operation="get").inc()
+        print(f"Redis module counts failed: {e}")
+        return await loader(), "database"
+
+
+async def store_module_counts(counts: Dict[str, int]):
+    """Replace the Redis counters with counts just reconciled against the database"""
+    if not redis_client:
+        return
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(MODULE_COUNTS_KEY)
+    pipe.hset(MODULE_COUNTS_KEY, mapping={**counts, MODULE_COUNTS_BUILT_FIELD: 1})
+    await pipe.execute()
+    CACHE_SETS.labels(family=key_family(MODULE_COUNTS_KEY), tier="redis").inc()
+
+
+async def incr_module_counts(counts: Dict[str, int]):
+    """Add newly enrolled students to the Redis counters, if they are built"""
+    if not redis_client or not counts:
+        return
+    pipe = redis_client.pipeline(transaction=True)
+    for module_code, n in counts.items():
+        pipe.hincrby(MODULE_COUNTS_KEY, module_code, n)
+    # Without the built field these increments are only a partial copy;
+    # drop them so the next read reloads every module from the database
+    pipe.hexists(MODULE_COUNTS_KEY, MODULE_COUNTS_BUILT_FIELD)
+    *_, built = await pipe.execute()
+    if not built:
+        await redis_client.delete(MODULE_COUNTS_KEY)
+    CACHE_SETS.labels(family=key_family(MODULE_COUNTS_KEY), tier="redis").inc()
+
+
+async def invalidate_module_counts():
+    """Drop the Redis counters so the next read reloads them from module_stats"""
+    if not redis_client:
+        return
+    await redis_client.delete(MODULE_COUNTS_KEY)
+    CACHE_INVALIDATIONS.labels(family=key_family(MODULE_COUNTS_KEY)).inc()
@@ -0,0 +1,54 @@
+"""Gunicorn settings for running the API as several uvicorn workers"""
+import os
+
+# Every worker writes its metric samples here so /metrics can merge them.
+# Must be set before prometheus_client is imported anywhere in the master.
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus-api")
+
+from prometheus_client import multiprocess  # noqa: E402
+import multiprocessing
+import shutil
+import subprocess
+import sys
+
+bind = f"0.0.0.0:{os.getenv('API_PORT', '8080')}"
+worker_class = "uvicorn_worker.UvicornWorker"
+# Each worker may open DB_POOL_SIZE + DB_MAX_OVERFLOW connections (same
+# defaults as db_setup.py) plus its LISTEN connection. Together they must fit
+# in Postgres max_connections (DB_MAX_CONNECTIONS) minus what the ingest
+# worker, replication and admin tools need (DB_RESERVED_CONNECTIONS); replicas
+# see the same pools minus the LISTEN connection, so this bound covers them.
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "100"))
+DB_RESERVED_CONNECTIONS = int(os.getenv("DB_RESERVED_CONNECTIONS", "25"))
+CONNECTIONS_PER_WORKER = int(os.getenv("DB_POOL_SIZE", "5")) + int(os.getenv("DB_MAX_OVERFLOW", "10")) + 1
+MAX_WORKERS = (DB_MAX_CONNECTIONS - DB_RESERVED_CONNECTIONS) // CONNECTIONS_PER_WORKER
+# Async workers don't block on I/O, so one per core is enough, as far as the budget allows
+workers = int(os.getenv("API_WORKERS", str(max(min(multiprocessing.cpu_count(), MAX_WORKERS), 1))))
+if workers > MAX_WORKERS:
+    raise RuntimeError(f"{workers} workers * {CONNECTIONS_PER_WORKER} connections exceed the "
+                       f"{DB_MAX_CONNECTIONS - DB_RESERVED_CONNECTIONS} available under DB_MAX_CONNECTIONS; "
+                       f"lower API_WORKERS or the pool size")
+keepalive = int(os.getenv("API_KEEPALIVE_SECONDS", "5"))
+backlog = int(os.getenv("API_BACKLOG", "2048"))
+timeout = int(os.getenv("API_TIMEOUT_SECONDS", "60"))
+graceful_timeout = int(os.getenv("API_GRACEFUL_TIMEOUT_SECONDS", "30"))
+# Recycle workers now and then so slow leaks can't build up
+max_requests = int(os.getenv("API_MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("API_MAX_REQUESTS_JITTER", "1000"))
+accesslog = None
+errorlog = "-"
+
+def on_starting(server):
+    # Samples from a previous run would otherwise be added to the new ones
+    shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+    # Schema and triggers once per start, not per (recycled) worker. In a child
+    # process so the master never imports the engines and metrics workers
+    # must create for themselves after the fork, and without the multiprocess
+    # dir so its samples never join the workers'.
+    env = {k: v for k, v in os.environ.items() if k != "PROMETHEUS_MULTIPROC_DIR"}
+    subprocess.run([sys.executable, "migrate.py"], cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                   check=True)
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,281 @@
+"""Write-behind worker: drain the students:ingest Redis Stream into Postgres in batches.
+
+With STUDENT_WRITE_MODE=async, POST /student/add validates the student,
+XADDs it to students:ingest and answers 202 with a tracking id. This process
+reads the stream through the "ingest-workers" consumer group, so several
+copies can share the load, and for each batch of up to INGEST_BATCH_SIZE:
+
+  1. inserts every student in one transaction (the same multi-row INSERT
+     ... ON CONFLICT DO NOTHING as /student/bulk, module_stats included),
+     falling back to one savepoint per row if a row is rejected,
+  2. records inserted/failed under students:ingest:status:<tracking id>,
+     copies failures to students:ingest:dead, then XACKs and XDELs the batch,
+  3. updates the Redis caches once for the whole batch.
+
+Entries are only acknowledged after their rows are committed, so a crash
+means redelivery, never loss. Entries another consumer left pending for
+INGEST_CLAIM_IDLE_MS are claimed with XAUTOCLAIM; ones delivered more than
+INGEST_MAX_DELIVERIES times are dead-lettered instead of crashing the worker
+again. Database outages are retried in place without touching the stream.
+
+Usage: python ingest_worker.py
+"""
+from typing import Any, Dict, List, Tuple
+import asyncio
+import os
+import signal
+import socket
+import time
+
+from prometheus_client import start_http_server
+from pydantic import ValidationError
+from redis.exceptions import ResponseError
+from sqlalchemy import select
+from sqlalchemy.exc import DBAPIError
+
+import cache
+import model
+from db_setup import AsyncSessionLocal, publish_pool_metrics
+from metrics import INGEST_BATCH_SIZE, INGEST_FLUSH_TIME, INGEST_LAG, INGEST_PROCESSED
+from schema import StudentSchemaCreate
+from student_writes import (INGEST_DEAD_LETTER_KEY, INGEST_GROUP, INGEST_STATUS_PREFIX, INGEST_STATUS_TTL,
+                            INGEST_STREAM_KEY, insert_students, insert_students_each, mark_recent_write,
+                            rejected_row, update_students_cache)
+
+# Entries per flush, and how long to wait for more once the first one arrives
+INGEST_BATCH_SIZE_MAX = int(os.getenv('INGEST_BATCH_SIZE', '500'))
+INGEST_LINGER_MS = int(os.getenv('INGEST_LINGER_MS', '50'))
+INGEST_BLOCK_MS = int(os.getenv('INGEST_BLOCK_MS', '1000'))
+# Pending entries idle this long belong to a dead consumer and are claimed
+INGEST_CLAIM_IDLE_MS = int(os.getenv('INGEST_CLAIM_IDLE_MS', '60000'))
+INGEST_MAX_DELIVERIES = int(os.getenv('INGEST_MAX_DELIVERIES', '5'))
+INGEST_RETRY_SECONDS = float(os.getenv('INGEST_RETRY_SECONDS', '2'))
+INGEST_DEAD_LETTER_MAXLEN = int(os.getenv('INGEST_DEAD_LETTER_MAXLEN', '10000'))
+INGEST_METRICS_PORT = int(os.getenv('INGEST_METRICS_PORT', '9101'))
+# Stable across restarts so a restarted worker picks up its own pending entries
+INGEST_CONSUMER = os.getenv('INGEST_CONSUMER', socket.gethostname())
+
+# Set by SIGTERM/SIGINT; the batch in hand is finished, nothing new is read
+stopping = asyncio.Event()
+
+
+def parse_entries(messages, redelivered: bool) -> List[Dict[str, Any]]:
+    """Stream messages as dicts; fields is None for entries deleted while pending"""
+    return [{"id": entry_id, "fields": fields, "redelivered": redelivered} for entry_id, fields in messages]
+
+
+async def ensure_group():
+    """Create the consumer group (and the stream) unless another worker already did"""
+    try:
+        await cache.redis_client.xgroup_create(INGEST_STREAM_KEY, INGEST_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def read_batch(history: bool) -> List[Dict[str, Any]]:
+    """Up to INGEST_BATCH_SIZE entries; history re-reads this consumer's own unacknowledged ones"""
+    if history:
+        reply = await cache.redis_client.xreadgroup(INGEST_GROUP, INGEST_CONSUMER, {INGEST_STREAM_KEY: "0"},
+                                                    count=INGEST_BATCH_SIZE_MAX)
+        return parse_entries(reply[0][1], redelivered=True) if reply else []
+
+    reply = await cache.redis_client.xreadgroup(INGEST_GROUP, INGEST_CONSUMER, {INGEST_STREAM_KEY: ">"},
+                                                count=INGEST_BATCH_SIZE_MAX, block=INGEST_BLOCK_MS)
+    entries = parse_entries(reply[0][1], redelivered=False) if reply else []
+    if entries and len(entries) < INGEST_BATCH_SIZE_MAX and INGEST_LINGER_MS > 0:
+        # Give a burst a moment to arrive so it is flushed as one batch
+        await asyncio.sleep(INGEST_LINGER_MS / 1000)
+        reply = await cache.redis_client.xreadgroup(INGEST_GROUP, INGEST_CONSUMER, {INGEST_STREAM_KEY: ">"},
+                                                    count=INGEST_BATCH_SIZE_MAX - len(entries))
+        if reply:
+            entries.extend(parse_entries(reply[0][1], redelivered=False))
+    return entries
+
+
+async def claim_stale() -> List[Dict[str, Any]]:
+    """Take over entries a crashed consumer left pending"""
+    reply = await cache.redis_client.xautoclaim(INGEST_STREAM_KEY, INGEST_GROUP, INGEST_CONSUMER,
+                                                min_idle_time=INGEST_CLAIM_IDLE_MS, start_id="0-0",
+                                                count=INGEST_BATCH_SIZE_MAX)
+    return parse_entries(reply[1], redelivered=True)
+
+
+async def split_exhausted(entries: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Separate redelivered entries that already used up INGEST_MAX_DELIVERIES"""
+    redelivered = [e for e in entries if e["redelivered"]]
+    if not redelivered:
+        return entries, []
+    pending = await cache.redis_client.xpending_range(INGEST_STREAM_KEY, INGEST_GROUP,
+                                                      min=redelivered[0]["id"], max=redelivered[-1]["id"],
+                                                      count=len(entries), consumername=INGEST_CONSUMER)
+    deliveries = {p["message_id"]: p["times_delivered"] for p in pending}
+    exhausted_ids = {e["id"] for e in redelivered if deliveries.get(e["id"], 0) > INGEST_MAX_DELIVERIES}
+    return ([e for e in entries if e["id"] not in exhausted_ids],
+            [e for e in entries if e["id"] in exhausted_ids])
+
+
+async def insert_batch(candidates: List[Dict[str, Any]], errors: Dict[str, str]
+                       ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Insert the candidates' students; returns (inserted rows, replayed rows).
+
+    Rows rejected by Postgres are recorded in errors by entry id. A
+    redelivered entry whose row already exists with the same values was
+    committed before a crash and counts as replayed rather than failed.
+    """
+    records = [e["record"] for e in candidates]
+    async with AsyncSessionLocal() as db:
+        try:
+            inserted = await insert_students(db, records)
+            await db.commit()
+        except DBAPIError as e:
+            if not rejected_row(e):
+                raise
+            # One bad row spoils the statement; keep the good ones with a savepoint each
+            await db.rollback()
+            inserted, rejected = await insert_students_each(db, records)
+            for entry, error in zip(candidates, rejected):
+                if error:
+                    errors[entry["id"]] = error
+            await db.commit()
+
+        inserted_ids = {s["student_id"] for s in inserted}
+        conflicts = [e for e in candidates if e["record"]["student_id"] not in inserted_ids and e["id"] not in errors]
+        existing = {}
+        if any(e["redelivered"] for e in conflicts):
+            stmt = select(model.StudentModel).where(
+                model.StudentModel.student_id.in_([e["record"]["student_id"] for e in conflicts])
+            )
+            existing = {s.student_id: {
+                "student_id": s.student_id,
+                "first_name": s.first_name,
+                "last_name": s.last_name,
+                "module_code": s.module_code
+            } for s in (await db.execute(stmt)).scalars().all()}
+
+    replayed = []
+    for entry in conflicts:
+        if entry["redelivered"] and existing.get(entry["record"]["student_id"]) == entry["record"]:
+            replayed.append(entry["record"])
+        else:
+            errors[entry["id"]] = "student_id already exists"
+    return inserted, replayed
+
+
+async def process_batch(entries: List[Dict[str, Any]]):
+    """Insert, acknowledge and cache one batch of stream entries"""
+    start_time = time.perf_counter()
+    entries, exhausted = await split_exhausted(entries)
+    errors = {e["id"]: f"Gave up after {INGEST_MAX_DELIVERIES} deliveries" for e in exhausted}
+
+    candidates = []
+    seen = set()
+    for entry in entries:
+        if entry["fields"] is None:
+            continue
+        try:
+            entry["record"] = StudentSchemaCreate.model_validate_json(entry["fields"]["student"]).model_dump()
+        except (KeyError, ValidationError) as e:
+            errors[entry["id"]] = f"Invalid payload: {e}"
+            continue
+        # Same as two /student/add calls with one id: the first wins
+        if entry["record"]["student_id"] in seen:
+            errors[entry["id"]] = "student_id already exists"
+            continue
+        seen.add(entry["record"]["student_id"])
+        candidates.append(entry)
+
+    inserted, replayed = [], []
+    while candidates:
+        try:
+            inserted, replayed = await insert_batch(candidates, errors)
+            break
+        except Exception as e:
+            # Postgres is unreachable or similar; the entries stay ours until it is back
+            print(f"Ingest insert failed: {e}")
+            for entry in candidates:
+                errors.pop(entry["id"], None)
+            if stopping.is_set():
+                # Unacknowledged, so the next start re-reads them from our pending list
+                return
+            await asyncio.sleep(INGEST_RETRY_SECONDS)
+
+    now = time.time()
+    pipe = cache.redis_client.pipeline(transaction=True)
+    for entry in entries + exhausted:
+        fields = entry["fields"]
+        if fields is None:
+            continue
+        status_key = f"{INGEST_STATUS_PREFIX}{fields.get('tracking_id')}"
+        if entry["id"] in errors:
+            pipe.hset(status_key, mapping={"status": "failed", "error": errors[entry["id"]], "processed_at": now})
+            pipe.xadd(INGEST_DEAD_LETTER_KEY, {
+                "tracking_id": fields.get("tracking_id", ""),
+                "student": fields.get("student", ""),
+                "error": errors[entry["id"]],
+                "failed_at": now
+            }, maxlen=INGEST_DEAD_LETTER_MAXLEN, approximate=True)
+            INGEST_PROCESSED.labels(result="failed").inc()
+        else:
+            pipe.hset(status_key, mapping={"status": "inserted", "processed_at": now})
+            INGEST_PROCESSED.labels(result="inserted").inc()
+            if fields.get("queued_at"):
+                INGEST_LAG.observe(now - float(fields["queued_at"]))
+        pipe.expire(status_key, INGEST_STATUS_TTL)
+    ids = [e["id"] for e in entries + exhausted]
+    pipe.xack(INGEST_STREAM_KEY, INGEST_GROUP, *ids)
+    # Acknowledged entries are done with; keep the stream to what is still owed
+    pipe.xdel(INGEST_STREAM_KEY, *ids)
+    await pipe.execute()
+
+    stored = inserted + replayed
+    if stored:
+        await mark_recent_write()
+        # One cache update for the whole batch
+        await update_students_cache(stored)
+        if replayed:
+            # Their counts were added before the crash; rebuild rather than add twice
+            await cache.invalidate_module_counts()
+
+    INGEST_BATCH_SIZE.observe(len(ids))
+    INGEST_FLUSH_TIME.observe(time.perf_counter() - start_time)
+    print(f"Ingest batch: {len(ids)} entries, {len(inserted)} inserted, {len(replayed)} replayed, "
+          f"{len(errors)} failed")
+
+
+async def run():
+    await cache.connect()
+    if not cache.redis_client:
+        raise SystemExit("Ingest worker needs Redis")
+    await ensure_group()
+    if INGEST_METRICS_PORT > 0:
+        publish_pool_metrics()
+        start_http_server(INGEST_METRICS_PORT)
+
+    # Finish the batch in hand on docker stop instead of leaving it to be claimed
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    history = True
+    last_claim = 0.0
+    while not stopping.is_set():
+        try:
+            if time.monotonic() - last_claim >= INGEST_CLAIM_IDLE_MS / 1000:
+                last_claim = time.monotonic()
+                claimed = await claim_stale()
+                if claimed:
+                    await process_batch(claimed)
+            entries = await read_batch(history)
+            if history and not entries:
+                history = False
+            if entries:
+                await process_batch(entries)
+        except Exception as e:
+            print(f"Redis ingest read failed: {e}")
+            await asyncio.sleep(INGEST_RETRY_SECONDS)
+    await cache.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -1,55 +1,248 @@
-from fastapi import FastAPI, Depends
-from sqlalchemy.orm import Session
-from fastapi.responses import Response
-from prometheus_client import generate_latest, CONTENT_TYPE_LATEST, Counter, Histogram
-from db_setup import SessionLocal, engine
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from sqlalchemy import case, func, or_, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.middleware.gzip import GZipMiddleware
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST, CollectorRegistry, REGISTRY
+from prometheus_client import multiprocess
+from db_setup import AsyncSessionLocal, listen, publish_pool_metrics, read_session, replica_router
 import model
-from schema import StudentSchemaCreate, StudentSchemaReturn
-from typing import List, Dict, Any
-import redis
+import cache
+from metrics import (CACHE_ERRORS, CACHE_HITS, CACHE_INVALIDATIONS, CACHE_MISS_LOAD_TIME, CACHE_MISSES,
+                     CACHE_PAYLOAD_SIZE, CACHE_SETS, INGEST_ENQUEUED, MetricsMiddleware, SERIALIZATION_TIME,
+                     key_family)
+from schema import ModuleStatsSummaryReturn, StudentSchemaCreate, StudentSchemaReturn, StudentPageReturn
+from student_writes import (INGEST_DEAD_LETTER_KEY, INGEST_GROUP, INGEST_STATUS_PREFIX, INGEST_STATUS_TTL,
+                            INGEST_STREAM_KEY, PAGE_CACHE_FAMILY, PAGE_CACHE_PREFIX, PAGE_GENERATION_KEY,
+                            PAGE_INDEX_KEY, count_enrollments, insert_students, insert_students_each,
+                            invalidate_student_pages, fills_need_primary, mark_recent_write, pin_to_primary,
+                            reads_need_primary, rejected_row,
+                            update_students_cache)
+from typing import List, Dict, Any, Optional
+from pydantic import ValidationError
+from redis.exceptions import WatchError
+import asyncio
+from email.utils import formatdate, parsedate_to_datetime
+import base64
+import csv
+import io
 import time
 import os
 import json
+import orjson
+import uuid
 
 app = FastAPI(root_path="/api")
 
-# Redis connection with password from environment
-redis_password = os.getenv('REDIS_PASSWORD')
-try:
-    redis_client = redis.Redis(host='redis', port=6379, db=0, password=redis_password, decode_responses=True)
-    # Test the connection
-    redis_client.ping()
-    print("Redis connection successful")
-except Exception as e:
-    print(f"Redis connection failed: {e}")
-    redis_client = None
-
-model.Base.metadata.create_all(bind=engine)
-
-# Prometheus metrics
-REQUEST_COUNT = Counter('request_count', 'App request count', ['method', 'endpoint', 'status_code'])
-REQUEST_LATENCY = Histogram('request_latency_seconds', 'Request latency')
-
-def get_db():
-    db = SessionLocal()
-    try:
+# Tables and triggers are set up once per deployment by migrate.py
+
+@app.on_event("startup")
+async def check_redis_connection():
+    publish_pool_metrics()
+    await cache.connect()
+    if CACHE_VERIFY_INTERVAL > 0:
+        asyncio.create_task(verify_students_cache_periodically())
+    if MODULE_STATS_RECONCILE_INTERVAL > 0:
+        asyncio.create_task(reconcile_module_stats_periodically())
+    if DB_LISTEN_NOTIFY:
+        asyncio.create_task(listen(model.STUDENTS_CHANGED_CHANNEL, handle_students_change,
+                                   on_reconnect=reset_student_caches))
+    if replica_router.replicas:
+        asyncio.create_task(replica_router.check_periodically())
+
+@app.on_event("shutdown")
+async def stop_cache_listener():
+    await cache.close()
+
+# Compress any other large response on the fly; the roster endpoints send
+# pre-compressed bodies, which GZipMiddleware passes through untouched
+app.add_middleware(GZipMiddleware, minimum_size=cache.COMPRESS_MIN_BYTES)
+# Prometheus request count/latency for every route, recorded by the middleware
+app.add_middleware(MetricsMiddleware)
+
+# How often one replica checks the Redis roster copy against Postgres; 0 disables
+CACHE_VERIFY_INTERVAL = int(os.getenv('CACHE_VERIFY_INTERVAL_SECONDS', '300'))
+# How often one replica recounts module_stats with GROUP BY; 0 disables
+MODULE_STATS_RECONCILE_INTERVAL = int(os.getenv('MODULE_STATS_RECONCILE_SECONDS', '600'))
+
+# Follow NOTIFYs from the students triggers so writes that bypass the API
+# (pgweb, manual SQL) update the caches too; each is handled by one process
+DB_LISTEN_NOTIFY = os.getenv('DB_LISTEN_NOTIFY', 'true').lower() == 'true'
+NOTIFY_CLAIM_PREFIX = "students:notify:"
+
+# Keyset pagination settings for /student/list (the cache keys live in student_writes.py)
+PAGE_CACHE_TTL = int(os.getenv('CACHE_PAGE_TTL_SECONDS', '120'))
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Module-filtered or field-projected rosters from /student/all, one entry per
+# query shape, tagged with the modules they cover; writes only drop entries
+# for their own modules, so the TTL can be long
+MODULE_ROSTER_PREFIX = "students:by_module:"
+MODULE_ROSTER_TTL = int(os.getenv('CACHE_MODULE_ROSTER_TTL_SECONDS', '600'))
+
+# Name search settings for /student/search; results are cached per roster version
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL_SECONDS', '30'))
+DEFAULT_SEARCH_LIMIT = 10
+# Shorter terms have no trigrams, so the GIN indexes can't serve them
+MIN_SEARCH_LENGTH = 3
+MAX_SEARCH_LIMIT = 50
+SEARCH_CACHE_PREFIX = "students:search:"
+SEARCH_CACHE_FAMILY = "students:search"
+
+# Rows fetched per round trip from the server-side cursor in /student/export
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+EXPORT_COLUMNS = ["student_id", "first_name", "last_name", "module_code"]
+
+# "async" makes /student/add queue students on a Redis Stream for
+# ingest_worker.py and answer 202 with a tracking id; "sync" inserts directly
+STUDENT_WRITE_MODE = os.getenv('STUDENT_WRITE_MODE', 'sync').lower()
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+async def get_read_db(request: Request):
+    async with read_session(use_primary=reads_need_primary(request)) as db:
+        yield db
+
+def encode_cursor(student_id: int) -> str:
+    """Turn the last student_id of a page into an opaque cursor"""
+    return base64.urlsafe_b64encode(json.dumps({"after": student_id}).encode()).decode()
+
+def decode_cursor(cursor: str) -> int:
+    """Recover the student_id a cursor points after"""
+    try:
+        after = int(json.loads(base64.urlsafe_b64decode(cursor.encode()))["after"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # student_id is int4; asyncpg would reject anything wider with a 500
+    if not -2**31 <= after < 2**31:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return after
+
+def page_cache_key(module_code: Optional[str], after: Optional[int], limit: int) -> str:
+    return f"{PAGE_CACHE_PREFIX}{module_code or '*'}:{'start' if after is None else after}:{limit}"
+
+async def roster_validators() -> Dict[str, str]:
+    """ETag and Last-Modified headers for the current roster version.
+
+    Read before the body, so a write racing the read can only make the
+    client download again, never keep a stale copy.
+    """
+    current = await cache.get_roster_version()
+    if current is None:
+        return {}
+    version, modified = current
+    return {
+        "ETag": f'W/"{version}"',
+        "Last-Modified": formatdate(modified, usegmt=True),
+        "Cache-Control": "no-cache"
+    }
+
+def is_not_modified(request: Request, validators: Dict[str, str]) -> bool:
+    """Whether the client's conditional headers match the current roster"""
+    if not validators:
+        return False
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Weak comparison, as RFC 9110 requires for If-None-Match
+        current = validators["ETag"].removeprefix("W/")
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or current in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+            return parsedate_to_datetime(validators["Last-Modified"]) <= since
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def not_modified_response(validators: Dict[str, str]) -> Response:
+    return Response(status_code=304, headers=validators)
+
+def accepted_encodings(request: Request) -> List[str]:
+    """Content codings the client accepts with q > 0"""
+    accepted = []
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip()[2:] if params.strip().startswith("q=") else "1"
+        try:
+            if coding and float(q) > 0:
+                accepted.append(coding.strip().lower())
+        except ValueError:
+            continue
+    return accepted
+
+async def roster_response(request: Request, payload: bytes, headers: Dict[str, str],
+                          key: str = cache.ROSTER_KEY) -> Response:
+    """Send a cached roster body, compressed with its cached br/gzip variant when accepted"""
+    if len(payload) >= cache.COMPRESS_MIN_BYTES:
+        accepted = accepted_encodings(request)
+        encoding = "br" if "br" in accepted else "gzip" if "gzip" in accepted else None
+        if encoding:
+            # GZipMiddleware adds Vary itself only to the bodies it handles
+            payload = await cache.compressed_variant(key, payload, encoding)
+            headers = {**headers, "Content-Encoding": encoding, "Vary": "Accept-Encoding"}
+    return Response(content=payload, media_type="application/json", headers=headers)
 
 # Health check endpoint
 @app.get("/health")
-def health_check():
+async def health_check():
     return {"status": "healthy", "service": "api", "timestamp": time.time()}
 
 @app.get("/metrics")
-def metrics():
-    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+async def metrics():
+    # Under gunicorn each worker keeps its own samples; merge them from disk
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+async def enqueue_student(request: Request, student: StudentSchemaCreate) -> Optional[JSONResponse]:
+    """Queue a validated student for the ingest worker; None if Redis is unavailable"""
+    if not cache.redis_client:
+        return None
+    tracking_id = uuid.uuid4().hex
+    queued_at = time.time()
+    try:
+        pipe = cache.redis_client.pipeline(transaction=True)
+        # One MULTI, so the worker never sees an entry without its status
+        pipe.hset(f"{INGEST_STATUS_PREFIX}{tracking_id}", mapping={
+            "status": "queued", "student_id": student.student_id, "queued_at": queued_at
+        })
+        pipe.expire(f"{INGEST_STATUS_PREFIX}{tracking_id}", INGEST_STATUS_TTL)
+        pipe.xadd(INGEST_STREAM_KEY, {
+            "tracking_id": tracking_id, "student": student.model_dump_json(), "queued_at": queued_at
+        })
+        await pipe.execute()
+    except Exception as e:
+        print(f"Redis xadd failed: {e}")
+        return None
+    INGEST_ENQUEUED.inc()
+    status_url = str(request.url_for("ingest_status", tracking_id=tracking_id))
+    return JSONResponse(status_code=202, headers={"Location": status_url}, content={
+        "tracking_id": tracking_id,
+        "status": "queued",
+        "student_id": student.student_id,
+        "status_url": status_url
+    })
+
+@app.post("/student/add", response_model=StudentSchemaReturn,
+          responses={202: {"description": "Queued for the ingest worker (STUDENT_WRITE_MODE=async)"}})
+async def add_new_student(request: Request, response: Response, student: StudentSchemaCreate,
+                          db: AsyncSession = Depends(get_db)):
+    if STUDENT_WRITE_MODE == "async":
+        queued = await enqueue_student(request, student)
+        if queued is not None:
+            return queued
+        # Without Redis there is no queue; fall back to inserting now
 
-@app.post("/student/add", response_model=StudentSchemaReturn)
-def add_new_student(student: StudentSchemaCreate, db: Session = Depends(get_db)):
-    start_time = time.time()
-    
     new_student = model.StudentModel(
         student_id=student.student_id,
         first_name=student.first_name,
@@ -57,159 +250,650 @@ def add_new_student(student: StudentSchemaCreate, db: Session = Depends(get_db))
         module_code=student.module_code
     )
     db.add(new_student)
-    db.commit()
-    db.refresh(new_student)
+    await count_enrollments(db, {student.module_code: 1})
+    await db.commit()
+    await db.refresh(new_student)
+    await mark_recent_write()
+    pin_to_primary(response)
     
-    if redis_client:
+    await update_students_cache([{
+        "student_id": new_student.student_id,
+        "first_name": new_student.first_name,
+        "last_name": new_student.last_name,
+        "module_code": new_student.module_code
+    }])
+    return new_student
+
+async def read_bulk_payload(request: Request) -> List[Dict[str, Any]]:
+    """Parse a bulk upload given as a JSON array, a CSV body or a CSV file upload"""
+    content_type = request.headers.get("content-type", "")
+
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Missing 'file' in upload")
+        text = (await upload.read()).decode("utf-8-sig")
+        return list(csv.DictReader(io.StringIO(text)))
+
+    if content_type.startswith("text/csv"):
+        text = (await request.body()).decode("utf-8-sig")
+        return list(csv.DictReader(io.StringIO(text)))
+
+    try:
+        rows = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or CSV")
+    if not isinstance(rows, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or CSV")
+    return rows
+
+@app.post("/student/bulk")
+async def bulk_add_students(response: Response, rows: List[Dict[str, Any]] = Depends(read_bulk_payload),
+                            db: AsyncSession = Depends(get_db)):
+    """Validate and insert many students at once, reporting per-row errors"""
+    start_time = time.time()
+
+    errors = []
+    valid = {}
+    for row_number, row in enumerate(rows, start=1):
         try:
-            # Invalidate /all cache here so the next /all fetch is fresh
-            redis_client.delete("students:all")
-        except Exception as e:
-            print(f"Redis setex failed: {e}")
+            student = StudentSchemaCreate.model_validate(row)
+        except ValidationError as e:
+            errors.append({"row": row_number, "error": "; ".join(
+                f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()
+            )})
+            continue
+        if student.student_id in valid:
+            errors.append({"row": row_number, "student_id": student.student_id,
+                           "error": "Duplicate student_id in upload"})
+            continue
+        valid[student.student_id] = (row_number, student.model_dump())
 
-    REQUEST_COUNT.labels(method='POST', endpoint='/student/add', status_code=200).inc()
-    REQUEST_LATENCY.observe(time.time() - start_time)
-    return new_student
+    records = [record for _, record in valid.values()]
+    rejected_ids = set()
+    try:
+        inserted = await insert_students(db, records)
+    except DBAPIError as e:
+        if not rejected_row(e):
+            raise
+        # Validation should have caught this; report the offending rows rather than fail them all
+        await db.rollback()
+        inserted, rejected = await insert_students_each(db, records)
+        for (row_number, record), error in zip(valid.values(), rejected):
+            if error:
+                rejected_ids.add(record["student_id"])
+                errors.append({"row": row_number, "student_id": record["student_id"], "error": error})
+    await db.commit()
+    if inserted:
+        await mark_recent_write()
+        pin_to_primary(response)
+
+    inserted_ids = {s["student_id"] for s in inserted}
+    for student_id, (row_number, _) in valid.items():
+        if student_id not in inserted_ids and student_id not in rejected_ids:
+            errors.append({"row": row_number, "student_id": student_id,
+                           "error": "student_id already exists"})
+    errors.sort(key=lambda e: e["row"])
+
+    # One cache update for the whole batch
+    await update_students_cache(inserted)
+
+    response_time = time.time() - start_time
+
+    return {
+        "received": len(rows),
+        "inserted": len(inserted),
+        "failed": len(errors),
+        "errors": errors,
+        "response_time_ms": round(response_time * 1000, 2)
+    }
+
+async def load_all_students(primary: bool = False) -> List[Dict[str, Any]]:
+    """Read the full roster from the database.
+
+    Uses its own session because the cache may run it as a background
+    refresh after the request that triggered it has finished. Reads from a
+    replica unless primary is set or a write just happened.
+    """
+    async with read_session(use_primary=primary or await fills_need_primary()) as db:
+        students = (await db.execute(select(model.StudentModel))).scalars().all()
+        return [{
+            "student_id": s.student_id,
+            "first_name": s.first_name,
+            "last_name": s.last_name,
+            "module_code": s.module_code
+        } for s in students]
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    """Requested columns from a comma-separated list, in canonical order"""
+    if not fields:
+        return EXPORT_COLUMNS
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = requested - set(EXPORT_COLUMNS)
+    if unknown or not requested:
+        raise HTTPException(status_code=400, detail=f"fields must be drawn from {', '.join(EXPORT_COLUMNS)}")
+    return [c for c in EXPORT_COLUMNS if c in requested]
+
+async def load_module_roster(module_code: Optional[str], columns: List[str]) -> List[Dict[str, Any]]:
+    """Read one module's students (or everyone's) with only the given columns"""
+    async with read_session(use_primary=await fills_need_primary()) as db:
+        stmt = select(*[getattr(model.StudentModel, c) for c in columns])
+        if module_code:
+            stmt = stmt.where(model.StudentModel.module_code == module_code)
+        rows = await db.execute(stmt.order_by(model.StudentModel.student_id))
+        return [dict(r) for r in rows.mappings()]
 
 @app.get("/student/all", response_model=List[StudentSchemaReturn])
-def read_items(db: Session = Depends(get_db)):
-    start_time = time.time()
-    
-    # Try cache first (only if Redis is available)
-    cache_key = "students:all"
-    cached = None
-    
-    if redis_client:
+async def read_items(request: Request, module_code: Optional[str] = None, fields: Optional[str] = None):
+    validators = await roster_validators()
+    if is_not_modified(request, validators):
+        return not_modified_response(validators)
+
+    if module_code or fields:
+        # Keyed by query shape and tagged by module, so a write to another
+        # module leaves this entry alone
+        columns = parse_fields(fields)
+        key = f"{MODULE_ROSTER_PREFIX}{module_code or '*'}:{','.join(columns)}"
+        payload, _ = await cache.get_or_load(key, MODULE_ROSTER_TTL,
+                                             lambda: load_module_roster(module_code, columns),
+                                             tags=[cache.module_tag(module_code)])
+        return await roster_response(request, payload, validators, key=key)
+
+    # Concurrent misses share a single database query
+    payload, _ = await cache.get_roster(load_all_students)
+
+    # The cached body is already the final JSON; skip validation and re-encoding
+    return await roster_response(request, payload, validators)
+
+@app.get("/student/list", response_model=StudentPageReturn)
+async def list_students(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    module_code: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Keyset-paginated student listing, optionally filtered by module_code"""
+    after = decode_cursor(cursor) if cursor else None
+    cache_key = page_cache_key(module_code, after, limit)
+
+    validators = await roster_validators()
+    if is_not_modified(request, validators):
+        return not_modified_response(validators)
+
+    generation = None
+    if cache.redis_bytes_client:
         try:
-            cached = redis_client.get(cache_key)
+            pipe = cache.redis_bytes_client.pipeline()
+            pipe.get(cache_key)
+            pipe.get(PAGE_GENERATION_KEY)
+            cached, generation = await pipe.execute()
+            if cached:
+                CACHE_HITS.labels(family=PAGE_CACHE_FAMILY, tier="redis").inc()
+                CACHE_PAYLOAD_SIZE.labels(family=PAGE_CACHE_FAMILY).observe(len(cached))
+                return Response(content=cached, media_type="application/json",
+                                headers={**validators, "X-Cache": "hit"})
         except Exception as e:
+            CACHE_ERRORS.labels(family=PAGE_CACHE_FAMILY, operation="get").inc()
             print(f"Redis get failed: {e}")
-    
-    if cached:
-        try:
-            cached_students = json.loads(cached)
-            REQUEST_COUNT.labels(method='GET', endpoint='/student/all', status_code=200).inc()
-            REQUEST_LATENCY.observe(time.time() - start_time)
-            return cached_students
-        except Exception as e:
-            print(f"Redis cache read failed: {e}")
-    
-    students = db.query(model.StudentModel).all()
-    
-    # Cache for 2 minutes (only if Redis is available)
-    if redis_client:
+    CACHE_MISSES.labels(family=PAGE_CACHE_FAMILY).inc()
+
+    stmt = select(model.StudentModel)
+    if module_code:
+        # Served by idx_students_module_code
+        stmt = stmt.where(model.StudentModel.module_code == module_code)
+    if after is not None:
+        stmt = stmt.where(model.StudentModel.student_id > after)
+    # Fetch one extra row to know whether another page exists
+    stmt = stmt.order_by(model.StudentModel.student_id).limit(limit + 1)
+    with CACHE_MISS_LOAD_TIME.labels(family=PAGE_CACHE_FAMILY).time():
+        students = (await db.execute(stmt)).scalars().all()
+
+    has_more = len(students) > limit
+    students = students[:limit]
+    page = {
+        "data": [{
+            "student_id": s.student_id,
+            "first_name": s.first_name,
+            "last_name": s.last_name,
+            "module_code": s.module_code
+        } for s in students],
+        "next_cursor": encode_cursor(students[-1].student_id) if has_more else None
+    }
+    with SERIALIZATION_TIME.labels(kind="student_page").time():
+        body = orjson.dumps(page)
+
+    # A replica read just after someone else's write may be stale; fine for
+    # this client, but not for the cache every client shares
+    if cache.redis_bytes_client and (reads_need_primary(request) or not await fills_need_primary()):
         try:
-            students_data = [{
-                "student_id": s.student_id,
-                "first_name": s.first_name,
-                "last_name": s.last_name,
-                "module_code": s.module_code
-            } for s in students]
-            redis_client.setex(cache_key, 120, json.dumps(students_data))
+            # The bytes client again, so generation compares like for like
+            async with cache.redis_bytes_client.pipeline(transaction=True) as pipe:
+                # A write since our GET may have missed this page in the index;
+                # WATCH turns that into a skipped store instead of a stale page
+                await pipe.watch(PAGE_GENERATION_KEY)
+                if await pipe.get(PAGE_GENERATION_KEY) == generation:
+                    # Index the page by its upper bound so inserts can find it later
+                    upper = students[-1].student_id if has_more else "+inf"
+                    pipe.multi()
+                    pipe.setex(cache_key, PAGE_CACHE_TTL, body)
+                    pipe.zadd(PAGE_INDEX_KEY, {cache_key: upper})
+                    pipe.expire(PAGE_INDEX_KEY, PAGE_CACHE_TTL)
+                    await pipe.execute()
+                    CACHE_SETS.labels(family=PAGE_CACHE_FAMILY, tier="redis").inc()
+                    CACHE_PAYLOAD_SIZE.labels(family=PAGE_CACHE_FAMILY).observe(len(body))
+        except WatchError:
+            pass
         except Exception as e:
+            CACHE_ERRORS.labels(family=PAGE_CACHE_FAMILY, operation="set").inc()
             print(f"Redis setex failed: {e}")
 
-    REQUEST_COUNT.labels(method='GET', endpoint='/student/all', status_code=200).inc()
-    REQUEST_LATENCY.observe(time.time() - start_time)
-    return students
+    return Response(content=body, media_type="application/json", headers={**validators, "X-Cache": "miss"})
 
-@app.get("/student/all/with-cache-info")
-def read_items_with_cache_info(db: Session = Depends(get_db)) -> Dict[str, Any]:
-    start_time = time.time()
-    
-    # Try cache first (only if Redis is available)
-    cache_key = "students:all"
-    cached = None
-    cache_status = "miss"
-    ttl = None
-    cache_age = None
-    
-    if redis_client:
+def escape_like(value: str) -> str:
+    """Make user input match literally inside a LIKE pattern"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+@app.get("/student/search", response_model=List[StudentSchemaReturn])
+async def search_students(
+    request: Request,
+    q: str = Query(..., min_length=MIN_SEARCH_LENGTH, max_length=50),
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Case-insensitive name search; prefix matches rank before substring matches.
+
+    q needs at least MIN_SEARCH_LENGTH (3) characters: anything shorter can't
+    use the trigram indexes and would scan and rank every student.
+    """
+    term = q.strip().lower()
+    if len(term) < MIN_SEARCH_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Search needs at least {MIN_SEARCH_LENGTH} characters")
+
+    # The roster version is part of the key, so any write retires old results
+    # and the short TTL only has to bound memory for the popular prefixes
+    current = await cache.get_roster_version()
+    cache_key = f"{SEARCH_CACHE_PREFIX}{current[0]}:{limit}:{term}" if current else None
+    if cache_key:
         try:
-            cached = redis_client.get(cache_key)
+            cached = await cache.redis_bytes_client.get(cache_key)
             if cached:
-                cache_status = "hit"
-                ttl = redis_client.ttl(cache_key)
-                cache_age = 120 - ttl if ttl > 0 else None  # Calculate cache age
+                CACHE_HITS.labels(family=SEARCH_CACHE_FAMILY, tier="redis").inc()
+                return Response(content=cached, media_type="application/json", headers={"X-Cache": "hit"})
         except Exception as e:
+            CACHE_ERRORS.labels(family=SEARCH_CACHE_FAMILY, operation="get").inc()
             print(f"Redis get failed: {e}")
-    
-    response_time = time.time() - start_time
-    
-    if cached:
-        try:
-            cached_students = json.loads(cached)
-            REQUEST_COUNT.labels(method='GET', endpoint='/student/all/with-cache-info', status_code=200).inc()
-            REQUEST_LATENCY.observe(response_time)
-            return {
-                "data": cached_students,
-                "cache_info": {
-                    "status": cache_status,
-                    "source": "redis",
-                    "ttl_seconds": ttl,
-                    "cache_age_seconds": cache_age,
-                    "response_time_ms": round(response_time * 1000, 2)
-                }
-            }
-        except Exception as e:
-            print(f"Redis cache read failed: {e}")
-    
-    # Fetch from database
-    students = db.query(model.StudentModel).all()
-    students_data = [{
-        "student_id": s.student_id,
-        "first_name": s.first_name,
-        "last_name": s.last_name,
-        "module_code": s.module_code
-    } for s in students]
-    
-    # Cache for 2 minutes (only if Redis is available)
-    if redis_client:
+    CACHE_MISSES.labels(family=SEARCH_CACHE_FAMILY).inc()
+
+    # ILIKE on both names is answered by the gin_trgm_ops indexes
+    substring = f"%{escape_like(term)}%"
+    prefix = f"{escape_like(term)}%"
+    first_name, last_name = model.StudentModel.first_name, model.StudentModel.last_name
+    is_prefix = or_(first_name.ilike(prefix, escape="\\"), last_name.ilike(prefix, escape="\\"))
+    stmt = (
+        select(model.StudentModel)
+        .where(or_(first_name.ilike(substring, escape="\\"), last_name.ilike(substring, escape="\\")))
+        .order_by(case((is_prefix, 0), else_=1), last_name, first_name, model.StudentModel.student_id)
+        .limit(limit)
+    )
+    with CACHE_MISS_LOAD_TIME.labels(family=SEARCH_CACHE_FAMILY).time():
+        students = (await db.execute(stmt)).scalars().all()
+
+    with SERIALIZATION_TIME.labels(kind="student_search").time():
+        body = orjson.dumps([{
+            "student_id": s.student_id,
+            "first_name": s.first_name,
+            "last_name": s.last_name,
+            "module_code": s.module_code
+        } for s in students])
+
+    # Same rule as list pages: no replica results in the shared cache right after a write
+    if cache_key and (reads_need_primary(request) or not await fills_need_primary()):
         try:
-            redis_client.setex(cache_key, 120, json.dumps(students_data))
+            await cache.redis_bytes_client.setex(cache_key, SEARCH_CACHE_TTL, body)
+            CACHE_SETS.labels(family=SEARCH_CACHE_FAMILY, tier="redis").inc()
+            CACHE_PAYLOAD_SIZE.labels(family=SEARCH_CACHE_FAMILY).observe(len(body))
         except Exception as e:
+            CACHE_ERRORS.labels(family=SEARCH_CACHE_FAMILY, operation="set").inc()
             print(f"Redis setex failed: {e}")
-    
-    response_time = time.time() - start_time
 
-    REQUEST_COUNT.labels(method='GET', endpoint='/student/all/with-cache-info', status_code=200).inc()
-    REQUEST_LATENCY.observe(response_time)
-    
-    return {
-        "data": students_data,
-        "cache_info": {
-            "status": "miss",
-            "source": "database",
-            "ttl_seconds": 120,  # New cache TTL
-            "cache_age_seconds": 0,  # Fresh from database
-            "response_time_ms": round(response_time * 1000, 2)
-        }
+    return Response(content=body, media_type="application/json", headers={"X-Cache": "miss"})
+
+async def stream_students(fmt: str, module_code: Optional[str], primary: bool):
+    """Yield the students table in chunks straight off a server-side cursor"""
+    # The request-scoped session may close before the body is sent, so the
+    # stream owns its own session for as long as it runs
+    async with read_session(use_primary=primary) as db:
+        stmt = select(*[getattr(model.StudentModel, c) for c in EXPORT_COLUMNS])
+        if module_code:
+            stmt = stmt.where(model.StudentModel.module_code == module_code)
+        stmt = stmt.order_by(model.StudentModel.student_id)
+
+        # stream() runs the query on an asyncpg server-side cursor, so only
+        # one batch is ever held in memory
+        result = await db.stream(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)
+            yield buffer.getvalue()
+            async for rows in result.partitions():
+                buffer.seek(0)
+                buffer.truncate()
+                with SERIALIZATION_TIME.labels(kind="export_csv").time():
+                    writer.writerows(rows)
+                yield buffer.getvalue()
+        else:
+            async for rows in result.partitions():
+                with SERIALIZATION_TIME.labels(kind="export_ndjson").time():
+                    chunk = "".join(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n" for row in rows)
+                yield chunk
+
+@app.get("/student/export")
+async def export_students(
+    request: Request,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    module_code: Optional[str] = None
+):
+    """Stream every student as NDJSON or CSV without materializing the table"""
+    if format == "csv":
+        media_type = "text/csv"
+        filename = "students.csv"
+    else:
+        media_type = "application/x-ndjson"
+        filename = "students.ndjson"
+
+    response = StreamingResponse(
+        stream_students(format, module_code, reads_need_primary(request)),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+    return response
+
+@app.get("/student/all/with-cache-info", response_model=List[StudentSchemaReturn])
+async def read_items_with_cache_info(request: Request):
+    """The /student/all body, with where it came from in X-Cache-* headers.
+
+    The cache info differs per request, so it stays out of the body: that
+    way the body is the cached roster and its br/gzip variant is reused
+    instead of compressing the whole roster again on every call.
+    """
+    start_time = time.time()
+
+    validators = await roster_validators()
+    if is_not_modified(request, validators):
+        return not_modified_response(validators)
+
+    payload, cache_info = await cache.get_roster(load_all_students)
+
+    headers = {
+        **validators,
+        "X-Cache": cache_info["status"],
+        "X-Cache-Source": cache_info["source"],
+        "X-Cache-TTL": str(cache_info["ttl_seconds"]),
+        "X-Response-Time-Ms": str(round((time.time() - start_time) * 1000, 2))
     }
+    if cache_info["cache_age_seconds"] is not None:
+        headers["X-Cache-Age"] = str(cache_info["cache_age_seconds"])
+    return await roster_response(request, payload, headers)
+
+async def clear_student_caches() -> bool:
+    """Drop every cached student response; returns whether a roster copy was cached"""
+    cleared = await cache.clear_roster()
+    await cache.invalidate_all_tags()
+    await cache.invalidate(clear_all=True)
+    if cache.redis_client:
+        # Drop every cached list page along with its index
+        await cache.redis_client.incr(PAGE_GENERATION_KEY)
+        pages = await cache.redis_client.zrange(PAGE_INDEX_KEY, 0, -1)
+        await cache.redis_client.delete(PAGE_INDEX_KEY, *pages)
+        CACHE_INVALIDATIONS.labels(family=PAGE_CACHE_FAMILY).inc(len(pages))
+    return cleared
+
+async def reset_student_caches():
+    """Forget everything cached about students after changes we can't pin down"""
+    await clear_student_caches()
+    # Clients' ETags and the module counters may be stale too
+    await cache.bump_roster_version()
+    await cache.invalidate_module_counts()
+
+async def load_students_by_id(student_ids: List[int]) -> List[Dict[str, Any]]:
+    """Read the current rows for student_ids from the primary; deleted ids are absent"""
+    async with AsyncSessionLocal() as db:
+        stmt = select(model.StudentModel).where(model.StudentModel.student_id.in_(student_ids))
+        students = (await db.execute(stmt)).scalars().all()
+        return [{
+            "student_id": s.student_id,
+            "first_name": s.first_name,
+            "last_name": s.last_name,
+            "module_code": s.module_code
+        } for s in students]
+
+async def handle_students_change(payload: str):
+    """Bring the caches up to date with a write announced by the students triggers"""
+    change = json.loads(payload)
+    if cache.redis_client:
+        # Every API process hears every NOTIFY; one of them is enough
+        claimed = await cache.redis_client.set(f"{NOTIFY_CLAIM_PREFIX}{change['id']}", 1, nx=True, ex=300)
+        if not claimed:
+            return
+
+    if change["rows"] is None:
+        # TRUNCATE, or too many rows to list: start over
+        await reset_student_caches()
+        return
+
+    pairs = [(student_id, module_code) for student_id, module_code in change["rows"]]
+    student_ids = sorted({student_id for student_id, _ in pairs})
+    modules = {module_code for _, module_code in pairs}
+    try:
+        if change["op"] != "INSERT":
+            # Old values may sit under another id or module; drop them first
+            await cache.remove_from_roster(student_ids, modules)
+        await cache.patch_roster(await load_students_by_id(student_ids))
+        await invalidate_student_pages(pairs)
+        await cache.invalidate_tags(cache.module_tag(None), *{cache.module_tag(m) for m in modules})
+        # The trigger already updated module_stats in the writing transaction
+        await cache.invalidate_module_counts()
+    except Exception as e:
+        CACHE_ERRORS.labels(family=key_family(cache.ROSTER_KEY), operation="update").inc()
+        print(f"Redis update failed: {e}")
 
 @app.delete("/student/cache/clear")
-def clear_students_cache():
-    """Clear the students cache from Redis"""
+async def clear_students_cache():
+    """Clear the students cache from Redis and every replica's L1"""
     start_time = time.time()
     
-    cache_key = "students:all"
+    cache_key = cache.ROSTER_KEY
     cleared = False
     
-    if redis_client:
-        try:
-            result = redis_client.delete(cache_key)
-            cleared = result > 0
-        except Exception as e:
-            print(f"Redis delete failed: {e}")
-            return {"success": False, "error": str(e)}, 500
+    try:
+        cleared = await clear_student_caches()
+    except Exception as e:
+        print(f"Redis delete failed: {e}")
+        return {"success": False, "error": str(e)}, 500
     
     response_time = time.time() - start_time
-    
-    REQUEST_COUNT.labels(method='DELETE', endpoint='/student/cache/clear', status_code=200).inc()
-    REQUEST_LATENCY.observe(response_time)
 
     return {
         "success": True,
         "cleared": cleared,
         "cache_key": cache_key,
         "response_time_ms": round(response_time * 1000, 2)
-    }
\ No newline at end of file
+    }
+
+async def load_module_counts() -> Dict[str, int]:
+    """Read every module's count from the module_stats summary table"""
+    async with read_session(use_primary=await fills_need_primary()) as db:
+        rows = await db.execute(select(model.ModuleStatsModel.module_code, model.ModuleStatsModel.student_count))
+        return {module_code: count for module_code, count in rows}
+
+@app.get("/student/modules/stats", response_model=ModuleStatsSummaryReturn)
+async def module_stats(module_code: Optional[str] = None):
+    """Students per module from the maintained counters; never scans students"""
+    counts, source = await cache.get_module_counts(load_module_counts)
+    if module_code is not None:
+        counts = {module_code: counts.get(module_code, 0)}
+    return {
+        "data": [{"module_code": m, "student_count": n} for m, n in sorted(counts.items())],
+        "total_students": sum(counts.values()),
+        "source": source
+    }
+
+async def reconcile_module_stats() -> Dict[str, Any]:
+    """Recount students per module and correct module_stats and the Redis counters"""
+    start_time = time.time()
+    async with AsyncSessionLocal() as db:
+        # Holds off count_enrollments until we commit, so rows inserted
+        # meanwhile are counted by exactly one of us
+        await db.execute(text("LOCK TABLE module_stats IN SHARE ROW EXCLUSIVE MODE"))
+        actual = dict((await db.execute(
+            select(model.StudentModel.module_code, func.count()).group_by(model.StudentModel.module_code)
+        )).all())
+        recorded = dict((await db.execute(
+            select(model.ModuleStatsModel.module_code, model.ModuleStatsModel.student_count)
+        )).all())
+
+        drifted = sorted(m for m in set(actual) | set(recorded) if actual.get(m, 0) != recorded.get(m, 0))
+        table = model.ModuleStatsModel.__table__
+        fixes = [{"module_code": m, "student_count": actual[m]} for m in drifted if m in actual]
+        if fixes:
+            stmt = pg_insert(table).values(fixes)
+            await db.execute(stmt.on_conflict_do_update(index_elements=["module_code"], set_={
+                "student_count": stmt.excluded.student_count,
+                "updated_at": func.now()
+            }))
+        emptied = [m for m in drifted if m not in actual]
+        if emptied:
+            await db.execute(table.delete().where(table.c.module_code.in_(emptied)))
+        await db.commit()
+
+    try:
+        await cache.store_module_counts(actual)
+    except Exception as e:
+        CACHE_ERRORS.labels(family=key_family(cache.MODULE_COUNTS_KEY), operation="set").inc()
+        print(f"Redis module counts failed: {e}")
+    return {
+        "modules": len(actual),
+        "drifted": [{"module_code": m, "recorded": recorded.get(m, 0), "actual": actual.get(m, 0)} for m in drifted],
+        "response_time_ms": round((time.time() - start_time) * 1000, 2)
+    }
+
+async def reconcile_module_stats_periodically():
+    """Background job correcting counts for writes that bypass the API"""
+    while True:
+        if cache.redis_client:
+            try:
+                # One replica per interval; also fills module_stats on first start
+                lock = cache.redis_client.lock("lock:module_stats:reconcile",
+                                               timeout=MODULE_STATS_RECONCILE_INTERVAL, blocking=False)
+                if await lock.acquire():
+                    report = await reconcile_module_stats()
+                    if report["drifted"]:
+                        print(f"Module stats drift repaired: {report}")
+            except Exception as e:
+                print(f"Module stats reconciliation failed: {e}")
+        await asyncio.sleep(MODULE_STATS_RECONCILE_INTERVAL)
+
+@app.post("/student/modules/stats/reconcile")
+async def reconcile_module_stats_now():
+    """Recount module_stats from the students table right away"""
+    return await reconcile_module_stats()
+
+@app.get("/student/ingest")
+async def ingest_summary():
+    """Backlog of the write-behind queue: waiting, in-flight and dead-lettered students"""
+    if not cache.redis_client:
+        raise HTTPException(status_code=503, detail="Redis unavailable")
+    pipe = cache.redis_client.pipeline()
+    pipe.xlen(INGEST_STREAM_KEY)
+    pipe.xlen(INGEST_DEAD_LETTER_KEY)
+    length, dead_letters = await pipe.execute()
+    try:
+        pending = (await cache.redis_client.xpending(INGEST_STREAM_KEY, INGEST_GROUP))["pending"]
+    except Exception:
+        # No worker has created the consumer group yet
+        pending = 0
+    return {
+        "mode": STUDENT_WRITE_MODE,
+        # Processed entries are deleted, so the stream holds only unfinished ones
+        "backlog": max(length - pending, 0),
+        "in_flight": pending,
+        "dead_letters": dead_letters
+    }
+
+@app.get("/student/ingest/dead-letters")
+async def ingest_dead_letters(limit: int = Query(50, ge=1, le=1000)):
+    """Most recent students the ingest worker gave up on, with the reason"""
+    if not cache.redis_client:
+        raise HTTPException(status_code=503, detail="Redis unavailable")
+    entries = await cache.redis_client.xrevrange(INGEST_DEAD_LETTER_KEY, count=limit)
+    return [{
+        "tracking_id": fields.get("tracking_id"),
+        "student": json.loads(fields["student"]) if fields.get("student") else None,
+        "error": fields.get("error"),
+        "failed_at": float(fields["failed_at"]) if fields.get("failed_at") else None
+    } for _, fields in entries]
+
+@app.get("/student/ingest/{tracking_id}")
+async def ingest_status(tracking_id: str, response: Response):
+    """Where a queued student is: queued, inserted or failed"""
+    if not cache.redis_client:
+        raise HTTPException(status_code=503, detail="Redis unavailable")
+    status = await cache.redis_client.hgetall(f"{INGEST_STATUS_PREFIX}{tracking_id}")
+    if not status:
+        raise HTTPException(status_code=404, detail="Unknown or expired tracking id")
+    if status.get("status") == "inserted":
+        # The client learns of its write here; let it read the row back
+        pin_to_primary(response, float(status["processed_at"]))
+    return {"tracking_id": tracking_id, **status}
+
+async def verify_students_cache(repair: bool) -> Dict[str, Any]:
+    """Check the Redis roster copy against Postgres, rebuilding it on drift"""
+    # Read first, so a write patched in while we query shows up as a change
+    generation = await cache.roster_generation()
+    # Always the primary: a lagging replica would make the copy look wrong
+    students = await load_all_students(primary=True)
+    return await cache.verify_roster(students, generation, repair=repair)
+
+async def verify_students_cache_periodically():
+    """Background job recovering the roster copy from writes that bypass the API"""
+    while True:
+        await asyncio.sleep(CACHE_VERIFY_INTERVAL)
+        if not cache.redis_client:
+            continue
+        try:
+            # Only one replica needs to run each check; the lock is left to
+            # expire so the others skip this interval
+            lock = cache.redis_client.lock("lock:students:verify", timeout=CACHE_VERIFY_INTERVAL, blocking=False)
+            if await lock.acquire():
+                report = await verify_students_cache(repair=True)
+                if report["repaired"]:
+                    print(f"Roster cache drift repaired: {report}")
+        except Exception as e:
+            print(f"Roster cache verification failed: {e}")
+
+@app.get("/student/cache/verify")
+async def verify_cache():
+    """Report differences between the Redis roster copy and the database"""
+    report = await verify_students_cache(repair=False)
+    return report
+
+@app.post("/student/cache/rebuild")
+async def rebuild_cache():
+    """Rebuild the Redis roster copy from the database"""
+    start_time = time.time()
+
+    generation = await cache.roster_generation()
+    students = await load_all_students(primary=True)
+    if not await cache.rebuild_roster(students, generation):
+        raise HTTPException(status_code=409, detail="Students changed during the rebuild; try again")
+    response_time = time.time() - start_time
+
+    return {
+        "success": True,
+        "students": len(students),
+        "response_time_ms": round(response_time * 1000, 2)
+    }
@@ -0,0 +1,77 @@
+from prometheus_client import Counter, Histogram
+import time
+
+# Fine enough at the bottom for in-process cache hits, wide enough for full-table reads
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_COUNT = Counter('request_count', 'App request count', ['method', 'endpoint', 'status_code'])
+REQUEST_LATENCY = Histogram('request_latency_seconds', 'Request latency until the last body byte is sent',
+                            ['method', 'endpoint', 'status_code'], buckets=LATENCY_BUCKETS)
+DB_QUERY_TIME = Histogram('db_query_seconds', 'Time spent executing SQL statements',
+                          ['engine', 'operation'], buckets=LATENCY_BUCKETS)
+REDIS_COMMAND_TIME = Histogram('redis_command_seconds', 'Round trip time of Redis commands and pipelines',
+                               ['command'], buckets=LATENCY_BUCKETS)
+SERIALIZATION_TIME = Histogram('serialization_seconds', 'Time spent encoding response bodies',
+                               ['kind'], buckets=LATENCY_BUCKETS)
+
+# Cache effectiveness, labelled by key family (the key up to its second colon)
+# and tier: "memory" for the in-process L1, "redis" for the shared copy
+CACHE_HITS = Counter('cache_hits', 'Cache lookups answered from a cache tier', ['family', 'tier'])
+CACHE_MISSES = Counter('cache_misses', 'Cache lookups that had to load from the database', ['family'])
+CACHE_SETS = Counter('cache_sets', 'Entries written or patched in a cache tier', ['family', 'tier'])
+CACHE_INVALIDATIONS = Counter('cache_invalidations', 'Entries dropped because their data changed', ['family'])
+CACHE_EVICTIONS = Counter('cache_evictions', 'L1 entries evicted to stay within CACHE_L1_MAX_BYTES', ['family'])
+CACHE_ERRORS = Counter('cache_errors', 'Redis operations that failed and fell back', ['family', 'operation'])
+CACHE_PAYLOAD_SIZE = Histogram('cache_payload_bytes', 'Size of cached response bodies', ['family'],
+                               buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216))
+CACHE_DESERIALIZE_TIME = Histogram('cache_deserialize_seconds', 'Time turning a Redis reply back into a body',
+                                   ['family'], buckets=LATENCY_BUCKETS)
+CACHE_MISS_LOAD_TIME = Histogram('cache_miss_load_seconds', 'Database time spent refilling a missed entry',
+                                 ['family'], buckets=LATENCY_BUCKETS)
+
+# Write-behind ingestion (STUDENT_WRITE_MODE=async and ingest_worker.py)
+INGEST_ENQUEUED = Counter('ingest_enqueued', 'Students queued on the ingest stream by /student/add')
+INGEST_PROCESSED = Counter('ingest_processed', 'Queued students the worker finished with', ['result'])
+INGEST_BATCH_SIZE = Histogram('ingest_batch_size', 'Entries flushed per worker batch',
+                              buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000))
+INGEST_FLUSH_TIME = Histogram('ingest_flush_seconds', 'Time to insert, acknowledge and invalidate one batch',
+                              buckets=LATENCY_BUCKETS)
+INGEST_LAG = Histogram('ingest_lag_seconds', 'Time from enqueue to the batch that stored the student',
+                       buckets=LATENCY_BUCKETS)
+
+def key_family(key: str) -> str:
+    """Collapse a cache key to its family, e.g. students:list:all:0:50 -> students:list"""
+    return ":".join(key.split(":")[:2])
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording every HTTP request, including errors, by route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the scope; templates keep
+            # path parameters and unknown URLs from exploding label cardinality
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or "unmatched"
+            labels = {"method": scope["method"], "endpoint": endpoint, "status_code": status_code}
+            REQUEST_COUNT.labels(**labels).inc()
+            REQUEST_LATENCY.labels(**labels).observe(time.perf_counter() - start_time)
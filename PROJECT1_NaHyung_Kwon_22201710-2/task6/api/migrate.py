@@ -0,0 +1,27 @@
+"""Create or upgrade the database objects the API and ingest worker rely on.
+
+The students and module_stats tables (for volumes created before
+01-init.sql had them), the trigram name search indexes and the students
+NOTIFY triggers. Every step is
+idempotent, but CREATE OR REPLACE TRIGGER locks students against writes,
+so this runs once per deployment rather than in every worker: gunicorn's
+on_starting hook runs it before forking. Run it by hand before starting
+uvicorn directly.
+
+Usage: python migrate.py
+"""
+from db_setup import engine
+import model
+
+
+def migrate():
+    model.Base.metadata.create_all(bind=engine)
+    model.install_search_indexes(engine)
+    model.install_change_triggers(engine)
+    # Nothing else uses the sync engine; don't keep its connection open
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    migrate()
+    print("Database schema up to date")
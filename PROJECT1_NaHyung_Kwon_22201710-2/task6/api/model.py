@@ -1,4 +1,5 @@
-from sqlalchemy import  Column,  Integer, String
+from sqlalchemy import  Column,  DDL, DateTime, Index, Integer, String, event, func, text
+from sqlalchemy.exc import DBAPIError
 from db_setup import Base
 
 class StudentModel(Base):
@@ -7,3 +8,123 @@ class StudentModel(Base):
     first_name = Column(String(50), nullable=False)
     last_name = Column(String(50), nullable=False)
     module_code = Column(String(10), nullable=False, index=True)
+
+    # Trigram indexes serve case-insensitive prefix and substring search (ILIKE).
+    # create_all skips them on an existing table; install_search_indexes adds them
+    __table_args__ = (
+        Index("idx_students_first_name_trgm", "first_name",
+              postgresql_using="gin", postgresql_ops={"first_name": "gin_trgm_ops"}),
+        Index("idx_students_last_name_trgm", "last_name",
+              postgresql_using="gin", postgresql_ops={"last_name": "gin_trgm_ops"}),
+    )
+
+# gin_trgm_ops needs the extension when create_all builds the table itself
+event.listen(StudentModel.__table__, "before_create",
+             DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+
+class ModuleStatsModel(Base):
+    """Students per module, kept in step with students by every API write"""
+    __tablename__ = "module_stats"
+    module_code = Column(String(10), primary_key=True)
+    student_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+# Statement-level triggers announcing changes to students on the
+# students_changed channel, for writes that don't go through the API (pgweb,
+# manual SQL). They also keep module_stats in step with those writes. The
+# API's own connections set students.cache_maintained, since it updates both
+# itself. rows is a list of [student_id, module_code] pairs, old and new, or
+# null when the statement touched too many rows to list.
+STUDENTS_CHANGED_CHANNEL = "students_changed"
+NOTIFY_MAX_ROWS = 200  # keeps the payload well under NOTIFY's 8000 byte limit
+
+STUDENTS_NOTIFY_DDL = f"""
+CREATE OR REPLACE FUNCTION students_notify_change() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    changed json;
+    changed_count integer;
+BEGIN
+    IF current_setting('students.cache_maintained', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'TRUNCATE' THEN
+        DELETE FROM module_stats;
+        changed_count := NULL;
+    ELSIF TG_OP = 'INSERT' THEN
+        SELECT json_agg(json_build_array(student_id, module_code)), count(*) INTO changed, changed_count FROM new_rows;
+        INSERT INTO module_stats (module_code, student_count)
+        SELECT module_code, count(*) FROM new_rows GROUP BY module_code
+        ON CONFLICT (module_code) DO UPDATE
+        SET student_count = module_stats.student_count + EXCLUDED.student_count, updated_at = now();
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT json_agg(json_build_array(student_id, module_code)), count(*) INTO changed, changed_count FROM old_rows;
+        INSERT INTO module_stats (module_code, student_count)
+        SELECT module_code, -count(*) FROM old_rows GROUP BY module_code
+        ON CONFLICT (module_code) DO UPDATE
+        SET student_count = module_stats.student_count + EXCLUDED.student_count, updated_at = now();
+    ELSE
+        SELECT json_agg(json_build_array(student_id, module_code)), count(*) INTO changed, changed_count
+        FROM (SELECT student_id, module_code FROM old_rows UNION SELECT student_id, module_code FROM new_rows) c;
+        INSERT INTO module_stats (module_code, student_count)
+        SELECT module_code, sum(delta) FROM (
+            SELECT module_code, -1 AS delta FROM old_rows UNION ALL SELECT module_code, 1 FROM new_rows
+        ) d GROUP BY module_code HAVING sum(delta) <> 0
+        ON CONFLICT (module_code) DO UPDATE
+        SET student_count = module_stats.student_count + EXCLUDED.student_count, updated_at = now();
+    END IF;
+
+    IF changed_count = 0 THEN
+        RETURN NULL;
+    END IF;
+    DELETE FROM module_stats WHERE student_count <= 0;
+    PERFORM pg_notify('{STUDENTS_CHANGED_CHANNEL}', json_build_object(
+        'id', txid_current() || ':' || clock_timestamp(),
+        'op', TG_OP,
+        'rows', CASE WHEN changed_count <= {NOTIFY_MAX_ROWS} THEN changed END
+    )::text);
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE TRIGGER students_notify_insert AFTER INSERT ON students
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION students_notify_change();
+CREATE OR REPLACE TRIGGER students_notify_update AFTER UPDATE ON students
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION students_notify_change();
+CREATE OR REPLACE TRIGGER students_notify_delete AFTER DELETE ON students
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION students_notify_change();
+CREATE OR REPLACE TRIGGER students_notify_truncate AFTER TRUNCATE ON students
+    FOR EACH STATEMENT EXECUTE FUNCTION students_notify_change();
+"""
+
+def install_change_triggers(engine_):
+    """Create or update the students NOTIFY triggers; safe to run concurrently (see migrate.py)"""
+    with engine_.begin() as conn:
+        # Concurrent CREATE OR REPLACE of one function can fail; take turns
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('students_notify_change'))"))
+        conn.exec_driver_sql(STUDENTS_NOTIFY_DDL)
+
+# (index name, column) of the trigram indexes declared on StudentModel
+TRIGRAM_INDEXES = (
+    ("idx_students_first_name_trgm", "first_name"),
+    ("idx_students_last_name_trgm", "last_name"),
+)
+
+def install_search_indexes(engine_):
+    """Add the trigram indexes to a students table that create_all or 01-init.sql made without them"""
+    try:
+        with engine_.begin() as conn:
+            conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    except DBAPIError as e:
+        print(f"pg_trgm unavailable, name search stays unindexed: {e}")
+        return
+    # CONCURRENTLY keeps students writable while a populated table is indexed;
+    # it can't run inside a transaction
+    with engine_.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name, column in TRIGRAM_INDEXES:
+            # A failed concurrent build leaves an invalid index IF NOT EXISTS would keep
+            invalid = conn.execute(text("SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(:name) AND NOT indisvalid"),
+                                   {"name": name}).first()
+            if invalid:
+                conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            conn.exec_driver_sql(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON students USING gin ({column} gin_trgm_ops)")
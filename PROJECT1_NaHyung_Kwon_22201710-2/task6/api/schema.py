@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import List, Optional
 
 class StudentSchema(BaseModel):
     student_id: int
@@ -8,7 +9,12 @@ class StudentSchema(BaseModel):
 
 
 class StudentSchemaCreate(StudentSchema):
-    pass
+    # Bounded like the students columns (int4, VARCHAR(50), VARCHAR(10)), so
+    # bad input fails validation instead of the INSERT
+    student_id: int = Field(ge=-2**31, le=2**31 - 1)
+    first_name: str = Field(max_length=50)
+    last_name: str = Field(max_length=50)
+    module_code: str = Field(max_length=10)
 
 class StudentSchemaReturn(StudentSchema):
     student_id: int
@@ -17,4 +23,20 @@ class StudentSchemaReturn(StudentSchema):
     module_code: str
 
     class Config:
-        from_attributes = True 
+        from_attributes = True
+
+
+class StudentPageReturn(BaseModel):
+    data: List[StudentSchemaReturn]
+    next_cursor: Optional[str] = None
+
+
+class ModuleStatsReturn(BaseModel):
+    module_code: str
+    student_count: int
+
+
+class ModuleStatsSummaryReturn(BaseModel):
+    data: List[ModuleStatsReturn]
+    total_students: int
+    source: str
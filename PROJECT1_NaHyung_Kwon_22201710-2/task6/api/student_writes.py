@@ -0,0 +1,205 @@
+"""Student writes and the cache updates that follow them, shared by main.py and ingest_worker.py"""
+from typing import Any, Dict, List, Optional, Tuple
+import bisect
+import math
+import os
+import time
+
+from fastapi import Request, Response
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import cache
+import model
+from db_setup import replica_router
+from metrics import CACHE_ERRORS, CACHE_INVALIDATIONS, key_family
+
+# After a write, that client's reads stay on the primary this long so replica
+# lag can't hide it; 0 disables. The cookie holds the time of its last write.
+READ_YOUR_WRITES_SECONDS = float(os.getenv('DB_READ_YOUR_WRITES_SECONDS', '5'))
+WRITE_COOKIE = "last_write"
+# Fills of the caches every client shares read the primary for as long after
+# any write, or a lagging replica would cache pre-write data for everyone
+RECENT_WRITE_KEY = "db:recent_write"
+last_local_write = 0.0
+
+# Cached /student/list pages
+PAGE_CACHE_PREFIX = "students:list:"
+PAGE_INDEX_KEY = "students:list:index"
+PAGE_CACHE_FAMILY = "students:list"
+# Bumped by every page invalidation, so a page read before a write is never stored after it
+PAGE_GENERATION_KEY = "students:list:generation"
+
+# Rows per multi-row INSERT statement in /student/bulk
+BULK_BATCH_SIZE = int(os.getenv('BULK_BATCH_SIZE', '1000'))
+
+# The students:ingest stream /student/add feeds with STUDENT_WRITE_MODE=async
+INGEST_STREAM_KEY = "students:ingest"
+INGEST_GROUP = "ingest-workers"
+INGEST_DEAD_LETTER_KEY = "students:ingest:dead"
+INGEST_STATUS_PREFIX = "students:ingest:status:"
+INGEST_STATUS_TTL = int(os.getenv('INGEST_STATUS_TTL_SECONDS', '86400'))
+
+async def mark_recent_write():
+    """Send shared cache fills to the primary for READ_YOUR_WRITES_SECONDS, on every replica of the API"""
+    global last_local_write
+    last_local_write = time.time()
+    if READ_YOUR_WRITES_SECONDS > 0 and replica_router.replicas and cache.redis_client:
+        try:
+            await cache.redis_client.set(RECENT_WRITE_KEY, 1, px=int(READ_YOUR_WRITES_SECONDS * 1000))
+        except Exception as e:
+            print(f"Redis set failed: {e}")
+
+def pin_to_primary(response: Response, written_at: Optional[float] = None):
+    """Keep the client's reads on the primary for READ_YOUR_WRITES_SECONDS after its write"""
+    if READ_YOUR_WRITES_SECONDS > 0:
+        written_at = written_at or time.time()
+        max_age = math.ceil(written_at + READ_YOUR_WRITES_SECONDS - time.time())
+        if max_age > 0:
+            response.set_cookie(WRITE_COOKIE, str(written_at), max_age=max_age, httponly=True, samesite="lax")
+
+def reads_need_primary(request: Request) -> bool:
+    """Whether this client wrote recently enough that a replica might not have it yet"""
+    if READ_YOUR_WRITES_SECONDS <= 0 or not replica_router.replicas:
+        return False
+    try:
+        written_at = float(request.cookies.get(WRITE_COOKIE, "0"))
+    except ValueError:
+        return False
+    return time.time() - written_at < READ_YOUR_WRITES_SECONDS
+
+async def fills_need_primary() -> bool:
+    """Whether any write is recent enough that a replica might not have it yet"""
+    if READ_YOUR_WRITES_SECONDS <= 0 or not replica_router.replicas:
+        return False
+    if time.time() - last_local_write < READ_YOUR_WRITES_SECONDS:
+        return True
+    if cache.redis_client:
+        try:
+            return bool(await cache.redis_client.exists(RECENT_WRITE_KEY))
+        except Exception as e:
+            print(f"Redis exists failed: {e}")
+    return False
+
+async def invalidate_student_pages(students) -> int:
+    """Drop only the cached list pages whose key range covers new students.
+
+    `students` is a list of (student_id, module_code) pairs. Every cached page
+    is indexed by the last student_id it holds (or +inf for the final page),
+    so a page is stale only if after < student_id <= upper for a student in
+    its module scope.
+    """
+    if not cache.redis_client or not students:
+        return 0
+
+    # Before reading the index: a page being filled right now isn't in it yet,
+    # and this makes its store skip instead
+    await cache.redis_client.incr(PAGE_GENERATION_KEY)
+    all_ids = sorted(student_id for student_id, _ in students)
+    module_ids = {}
+    for student_id, module_code in students:
+        module_ids.setdefault(module_code, []).append(student_id)
+    for ids in module_ids.values():
+        ids.sort()
+
+    stale = []
+    for key, upper in await cache.redis_client.zrangebyscore(PAGE_INDEX_KEY, all_ids[0], "+inf", withscores=True):
+        scope, after, _ = key.rsplit(":", 2)
+        page_module = scope[len(PAGE_CACHE_PREFIX):]
+        ids = all_ids if page_module == "*" else module_ids.get(page_module, [])
+        # First new id strictly after the page's cursor
+        i = 0 if after == "start" else bisect.bisect_right(ids, int(after))
+        if i < len(ids) and ids[i] <= upper:
+            stale.append(key)
+
+    if stale:
+        pipe = cache.redis_client.pipeline()
+        pipe.delete(*stale)
+        pipe.zrem(PAGE_INDEX_KEY, *stale)
+        await pipe.execute()
+        CACHE_INVALIDATIONS.labels(family=PAGE_CACHE_FAMILY).inc(len(stale))
+    return len(stale)
+
+def module_counts(students: List[Dict[str, Any]]) -> Dict[str, int]:
+    """How many of the given students each module_code gains"""
+    counts = {}
+    for student in students:
+        counts[student["module_code"]] = counts.get(student["module_code"], 0) + 1
+    return counts
+
+async def count_enrollments(db: AsyncSession, counts: Dict[str, int]):
+    """Add to module_stats in the caller's transaction, so counts commit with the rows"""
+    if not counts:
+        return
+    table = model.ModuleStatsModel.__table__
+    stmt = pg_insert(table).values([
+        {"module_code": module_code, "student_count": n} for module_code, n in sorted(counts.items())
+    ])
+    stmt = stmt.on_conflict_do_update(index_elements=["module_code"], set_={
+        "student_count": table.c.student_count + stmt.excluded.student_count,
+        "updated_at": func.now()
+    })
+    await db.execute(stmt)
+
+async def update_students_cache(students: List[Dict[str, Any]]):
+    """Bring every cache entry up to date with newly written students"""
+    try:
+        # Patch the Redis roster copy in place so /all never needs Postgres
+        await cache.patch_roster(students)
+        await cache.incr_module_counts(module_counts(students))
+        # Module-scoped entries for other modules stay warm
+        await cache.invalidate_tags(cache.module_tag(None), *{cache.module_tag(s["module_code"]) for s in students})
+        # Only the list pages covering these student_ids need to go
+        await invalidate_student_pages([(s["student_id"], s["module_code"]) for s in students])
+    except Exception as e:
+        CACHE_ERRORS.labels(family=key_family(cache.ROSTER_KEY), operation="update").inc()
+        print(f"Redis update failed: {e}")
+
+async def insert_students(db: AsyncSession, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Multi-row INSERT of validated students, skipping existing ids; the caller commits.
+
+    Returns the rows that were inserted, and counts them into module_stats
+    in the same transaction.
+    """
+    inserted = []
+    for i in range(0, len(records), BULK_BATCH_SIZE):
+        batch = records[i:i + BULK_BATCH_SIZE]
+        # Same conflict handling as 01-init.sql; RETURNING tells us which rows landed
+        stmt = pg_insert(model.StudentModel.__table__).values(batch).on_conflict_do_nothing(
+            index_elements=["student_id"]
+        ).returning(*model.StudentModel.__table__.columns)
+        inserted.extend(dict(r) for r in (await db.execute(stmt)).mappings())
+    # Only rows that actually landed count; conflicts were skipped above
+    await count_enrollments(db, module_counts(inserted))
+    return inserted
+
+def rejected_row(error: DBAPIError) -> bool:
+    """Whether Postgres refused the data itself (SQLSTATE class 22 or 23) rather than failing.
+
+    asyncpg only maps some of these to DataError/IntegrityError, so the
+    SQLSTATE is the reliable signal.
+    """
+    return (getattr(error.orig, "sqlstate", None) or "")[:2] in ("22", "23")
+
+async def insert_students_each(db: AsyncSession, records: List[Dict[str, Any]]
+                               ) -> Tuple[List[Dict[str, Any]], List[Optional[str]]]:
+    """Insert records one savepoint at a time, after insert_students() rejected the batch.
+
+    Returns the inserted rows and, per record, Postgres' reason for
+    rejecting it or None. The caller rolled back the failed batch and
+    commits afterwards.
+    """
+    inserted = []
+    rejected = []
+    for record in records:
+        try:
+            async with db.begin_nested():
+                inserted.extend(await insert_students(db, [record]))
+            rejected.append(None)
+        except DBAPIError as e:
+            if not rejected_row(e):
+                raise
+            rejected.append(str(e.orig.__cause__ or e.orig).strip().splitlines()[0])
+    return inserted, rejected
@@ -0,0 +1,208 @@
+"""Micro-benchmark the API handlers in-process against Postgres and fakeredis.
+
+Runs main.app through httpx's ASGI transport, so no compose stack, Traefik
+or network is involved. Postgres is required because the handlers use
+Postgres-only SQL (ON CONFLICT, asyncpg); point POSTGRES_HOST/PORT/USER/
+PASSWORD/DB at any local instance. Redis is an in-process fakeredis.
+
+For each --rows count the harness seeds that many students (ids from
+--id-base up, removed again afterwards) and times these paths:
+
+  cold_miss          GET /student/all with L1 and Redis emptied first
+  warm_hit_redis     GET /student/all with only the L1 emptied first
+  warm_hit_memory    GET /student/all served from the in-process L1
+  revalidate_304     GET /student/all with a matching If-None-Match
+  list_page_miss     GET /student/list?limit=50 with its page uncached
+  insert_invalidate  POST /student/add, including write-through and page invalidation
+  serialize_roster   orjson.dumps of the seeded roster, the only encode a miss pays
+
+Statistics follow pytest-benchmark: min/max/mean/stddev/median/IQR/ops
+over --rounds timed calls after --warmup untimed ones.
+
+Requires the packages in requirements.txt next to this file.
+
+Usage: python api_bench.py [--rows 1000 10000] [--rounds 50] [--output bench.json]
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+
+
+def describe(timings: List[float]) -> Dict[str, float]:
+    """pytest-benchmark style summary of timings in seconds"""
+    q1, _, q3 = statistics.quantiles(timings, n=4) if len(timings) > 1 else (timings[0],) * 3
+    mean = statistics.fmean(timings)
+    return {
+        "rounds": len(timings),
+        "min": min(timings),
+        "max": max(timings),
+        "mean": mean,
+        "stddev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "median": statistics.median(timings),
+        "iqr": q3 - q1,
+        "ops": 1 / mean if mean else 0.0,
+    }
+
+
+async def bench(rounds: int, warmup: int, fn: Callable[[], Awaitable[Any]],
+                setup: Optional[Callable[[], Awaitable[Any]]] = None) -> Dict[str, float]:
+    """Time fn() rounds times; setup() runs before every call, outside the timer"""
+    timings = []
+    for i in range(warmup + rounds):
+        if setup:
+            await setup()
+        start = time.perf_counter()
+        await fn()
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            timings.append(elapsed)
+    return describe(timings)
+
+
+async def run(rows: int, args) -> Dict[str, Dict[str, float]]:
+    import httpx
+    import orjson
+    from sqlalchemy import delete
+
+    import cache
+    import main
+    import model
+    from db_setup import AsyncSessionLocal
+
+    async def remove_seeded():
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(model.StudentModel).where(model.StudentModel.student_id >= args.id_base))
+            await db.commit()
+        # API sessions skip the students triggers, so module_stats still counts
+        # the deleted rows; recount it like the periodic job would
+        await main.reconcile_module_stats()
+
+    async def clear_all_tiers():
+        await cache.clear_roster()
+        await cache.invalidate(clear_all=True)
+        await cache.redis_client.flushdb()
+
+    await remove_seeded()
+    students = [{
+        "student_id": args.id_base + i,
+        "first_name": f"Bench{i}",
+        "last_name": f"Row{i}",
+        "module_code": f"BEN{i % 50:03d}"
+    } for i in range(rows)]
+
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for i in range(0, rows, 1000):
+            response = await client.post("/student/bulk", json=students[i:i + 1000])
+            response.raise_for_status()
+        await clear_all_tiers()
+
+        async def get_all(headers=None):
+            response = await client.get("/student/all", headers=headers)
+            assert response.status_code in (200, 304), response.status_code
+            return response
+
+        results["cold_miss"] = await bench(args.rounds, args.warmup, get_all, setup=clear_all_tiers)
+
+        async def drop_l1():
+            cache.l1_cache.clear()
+
+        results["warm_hit_redis"] = await bench(args.rounds, args.warmup, get_all, setup=drop_l1)
+        await get_all()
+        results["warm_hit_memory"] = await bench(args.rounds, args.warmup, get_all)
+
+        etag = (await get_all()).headers["ETag"]
+        results["revalidate_304"] = await bench(args.rounds, args.warmup,
+                                                lambda: get_all({"If-None-Match": etag}))
+
+        async def drop_pages():
+            pages = await cache.redis_client.zrange(main.PAGE_INDEX_KEY, 0, -1)
+            await cache.redis_client.delete(main.PAGE_INDEX_KEY, *pages)
+
+        results["list_page_miss"] = await bench(args.rounds, args.warmup,
+                                                lambda: client.get("/student/list", params={"limit": 50}),
+                                                setup=drop_pages)
+
+        next_id = iter(range(args.id_base + rows, args.id_base + rows + args.rounds + args.warmup))
+
+        async def add_one():
+            student_id = next(next_id)
+            response = await client.post("/student/add", json={
+                "student_id": student_id, "first_name": "Bench", "last_name": "Insert", "module_code": "BEN999"
+            })
+            response.raise_for_status()
+
+        # Warm caches first so the write-through and page invalidation have work to do
+        await get_all()
+        await client.get("/student/list", params={"limit": 50})
+        results["insert_invalidate"] = await bench(args.rounds, args.warmup, add_one)
+
+        async def serialize():
+            orjson.dumps(students)
+
+        results["serialize_roster"] = await bench(args.rounds, args.warmup, serialize)
+
+    await clear_all_tiers()
+    await remove_seeded()
+    return results
+
+
+def print_results(rows: int, results: Dict[str, Dict[str, float]]):
+    print(f"\nrows={rows}")
+    print(f"{'benchmark':<20}{'min':>11}{'median':>11}{'mean':>11}{'stddev':>11}{'iqr':>11}{'max':>11}{'ops':>11}")
+    for name, stats in results.items():
+        cells = "".join(f"{stats[k] * 1000:>9.3f}ms" for k in ("min", "median", "mean", "stddev", "iqr", "max"))
+        print(f"{name:<20}{cells}{stats['ops']:>11.1f}")
+
+
+async def bench_all(args) -> Dict[str, Any]:
+    import fakeredis
+
+    import cache
+
+    # Swap the real clients for an in-process fake before anything connects
+    server = fakeredis.FakeServer()
+    cache.redis_client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+    cache.redis_bytes_client = fakeredis.FakeAsyncRedis(server=server)
+    await cache.connect()
+    try:
+        return {str(rows): await run(rows, args) for rows in args.rows}
+    finally:
+        await cache.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--id-base", type=int, default=900_000_000,
+                        help="seeded students use ids from here up and are deleted afterwards")
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    # Local defaults; anything already exported wins
+    os.environ.setdefault("POSTGRES_HOST", "localhost")
+    os.environ.setdefault("CACHE_VERIFY_INTERVAL_SECONDS", "0")
+    sys.path.insert(0, API_DIR)
+    from migrate import migrate
+    migrate()
+
+    results = asyncio.run(bench_all(args))
+    for rows, by_name in results.items():
+        print_results(int(rows), by_name)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"rows": results, "rounds": args.rounds}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
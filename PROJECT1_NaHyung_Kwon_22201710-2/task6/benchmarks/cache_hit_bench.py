@@ -0,0 +1,142 @@
+"""Compare /student/all cache-hit latency before and after pre-serialized caching.
+
+"before" is the old hit path: json.loads the cached roster, then let FastAPI
+validate it against List[StudentSchemaReturn] and encode it again.
+"after" hands the cached bytes back in a raw Response. These two are toy
+endpoints, so they leave out fetching the body from Redis.
+
+"redis" and "memory" time the real handler, read_items in api/main.py, with
+the roster in an in-process fakeredis: "redis" with the L1 disabled, so
+every request reads and joins the roster copy, "memory" served from the L1.
+
+Everything runs in-process through httpx's ASGI transport, so the numbers
+are handler, Redis client and serialization cost without the network.
+
+Requires the packages in requirements.txt next to this file.
+
+Usage: python cache_hit_bench.py [--rows 10000 100000] [--requests 50]
+"""
+from fastapi import FastAPI
+from fastapi.responses import Response
+from typing import List
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+import httpx
+import orjson
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+sys.path.insert(0, API_DIR)
+from schema import StudentSchemaReturn  # noqa: E402
+
+
+def build_app(payload: bytes) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/before", response_model=List[StudentSchemaReturn])
+    async def before():
+        return json.loads(payload)
+
+    @app.get("/after", response_model=List[StudentSchemaReturn])
+    async def after():
+        return Response(content=payload, media_type="application/json")
+
+    return app
+
+
+async def measure(client: httpx.AsyncClient, path: str, requests: int) -> List[float]:
+    # One warm-up request so route setup isn't counted
+    await client.get(path)
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = await client.get(path)
+        timings.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+    return timings
+
+
+async def run(rows: int, requests: int):
+    students = [{
+        "student_id": i,
+        "first_name": f"First{i}",
+        "last_name": f"Last{i}",
+        "module_code": f"COMP{30000 + i % 50}"
+    } for i in range(1, rows + 1)]
+    payload = orjson.dumps(students)
+
+    transport = httpx.ASGITransport(app=build_app(payload))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        results = {}
+        for path in ("/before", "/after"):
+            timings = await measure(client, path, requests)
+            results[path] = timings
+            print(f"rows={rows:<7} {path[1:]:<7} "
+                  f"median={statistics.median(timings):8.2f}ms "
+                  f"p95={sorted(timings)[int(len(timings) * 0.95) - 1]:8.2f}ms "
+                  f"body={len(payload) / 1024:.0f}KiB")
+        speedup = statistics.median(results["/before"]) / statistics.median(results["/after"])
+        print(f"rows={rows:<7} speedup x{speedup:.1f}")
+
+    await run_read_items(students, payload, requests)
+
+
+async def run_read_items(students: List[dict], payload: bytes, requests: int):
+    """Time GET /student/all through main.app, from Redis and from the L1"""
+    import fakeredis
+
+    import cache
+    import main
+
+    server = fakeredis.FakeServer()
+    cache.redis_client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+    cache.redis_bytes_client = fakeredis.FakeAsyncRedis(server=server)
+    await cache.connect()
+    l1_max_bytes = cache.l1_cache.max_bytes
+    try:
+        async def load():
+            return students
+
+        # Fill the Redis roster copy the way a first miss would
+        cache.l1_cache.clear()
+        await cache.get_roster(load)
+
+        transport = httpx.ASGITransport(app=main.app)
+        # Uncompressed, like the toy endpoints; otherwise "redis" would gzip every body
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench",
+                                     headers={"Accept-Encoding": "identity"}) as client:
+            for source in ("redis", "memory"):
+                cache.l1_cache.clear()
+                # A zero budget makes the L1 drop every body it is handed
+                cache.l1_cache.max_bytes = 0 if source == "redis" else l1_max_bytes
+                timings = await measure(client, "/student/all", requests)
+                # A miss would have gone to Postgres instead of the seeded roster
+                assert (await client.get("/student/all")).content == payload
+                print(f"rows={len(students):<7} {source:<7} "
+                      f"median={statistics.median(timings):8.2f}ms "
+                      f"p95={sorted(timings)[int(len(timings) * 0.95) - 1]:8.2f}ms "
+                      f"body={len(payload) / 1024:.0f}KiB")
+    finally:
+        cache.l1_cache.max_bytes = l1_max_bytes
+        await cache.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+    # main.py reads these at import; nothing here connects to Postgres
+    os.environ.setdefault("CACHE_VERIFY_INTERVAL_SECONDS", "0")
+    os.environ.setdefault("DB_LISTEN_NOTIFY", "false")
+    for rows in args.rows:
+        asyncio.run(run(rows, args.requests))
+
+
+if __name__ == "__main__":
+    main()
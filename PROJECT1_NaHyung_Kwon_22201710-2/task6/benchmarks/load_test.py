@@ -0,0 +1,296 @@
+"""Load-test the running compose stack and write a latency/throughput report.
+
+Scenarios:
+  read         GET /student/all, /student/all/with-cache-info and /student/list
+  write        POST /student/add with fresh student_ids
+  clear-storm  readers on /student/all while one worker keeps clearing the cache
+  web          web-app page views through Traefik (/app/all, /app/, /app/add)
+  mixed        all of the above in one run, weighted towards reads
+
+Each run optionally seeds N students through /student/bulk first, then keeps
+--concurrency workers busy for --duration seconds. The JSON report has
+p50/p95/p99 latency, throughput and status counts per endpoint plus the git
+commit, so runs can be compared across commits with --compare.
+
+Usage:
+  python load_test.py --scenario read --seed 10000 --duration 60 --output reports/read.json
+  python load_test.py --compare reports/before.json reports/after.json
+"""
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+SEED_BATCH_SIZE = 1000
+MODULE_CODES = [f"LOAD{n:03d}" for n in range(20)]
+
+# Operation name -> relative weight for each scenario
+SCENARIOS: Dict[str, Dict[str, int]] = {
+    "read": {"api_all": 80, "api_all_with_cache_info": 10, "api_list": 10},
+    "write": {"api_add": 1},
+    "clear-storm": {"api_all": 1},
+    "web": {"web_all": 70, "web_index": 20, "web_add_form": 10},
+    "mixed": {"api_all": 40, "api_all_with_cache_info": 10, "api_list": 10, "api_add": 10,
+              "web_all": 20, "web_index": 5, "web_add_form": 5},
+}
+
+
+def default_id_base() -> int:
+    """A student_id range that changes every minute, so reruns don't collide"""
+    return 100_000_000 + (int(time.time()) // 60 % 10_000) * 100_000
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def encode_cursor(after: int) -> str:
+    """Same encoding as encode_cursor() in api/main.py"""
+    return base64.urlsafe_b64encode(json.dumps({"after": after}).encode()).decode()
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+class Recorder:
+    """Latencies, status codes and errors per operation"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(self, name: str, elapsed_ms: float, status: str, ok: bool):
+        self.latencies.setdefault(name, []).append(elapsed_ms)
+        counts = self.statuses.setdefault(name, {})
+        counts[status] = counts.get(status, 0) + 1
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, duration: float) -> Dict[str, Any]:
+        endpoints = {}
+        for name, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            endpoints[name] = {
+                "requests": len(values),
+                "errors": self.errors.get(name, 0),
+                "throughput_rps": round(len(values) / duration, 2),
+                "p50_ms": round(percentile(values, 50), 2),
+                "p95_ms": round(percentile(values, 95), 2),
+                "p99_ms": round(percentile(values, 99), 2),
+                "max_ms": round(values[-1], 2),
+                "status": self.statuses[name]
+            }
+        everything = sorted(v for values in self.latencies.values() for v in values)
+        totals = {
+            "requests": len(everything),
+            "errors": sum(self.errors.values()),
+            "throughput_rps": round(len(everything) / duration, 2),
+            "p50_ms": round(percentile(everything, 50), 2) if everything else None,
+            "p95_ms": round(percentile(everything, 95), 2) if everything else None,
+            "p99_ms": round(percentile(everything, 99), 2) if everything else None,
+        }
+        return {"totals": totals, "endpoints": endpoints}
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.recorder = Recorder()
+        self.next_id = itertools.count(args.id_base + args.seed)
+        self.seeded_max = args.id_base + args.seed - 1
+
+    def random_student(self, student_id: int) -> Dict[str, Any]:
+        return {
+            "student_id": student_id,
+            "first_name": f"Load{student_id % 100000}",
+            "last_name": f"Test{random.randint(0, 9999)}",
+            "module_code": random.choice(MODULE_CODES)
+        }
+
+    async def seed(self, client: httpx.AsyncClient) -> int:
+        """Insert --seed students through the bulk endpoint before measuring"""
+        inserted = 0
+        ids = range(self.args.id_base, self.args.id_base + self.args.seed)
+        for i in range(0, len(ids), SEED_BATCH_SIZE):
+            batch = [self.random_student(student_id) for student_id in ids[i:i + SEED_BATCH_SIZE]]
+            response = await client.post(f"{self.args.api_url}/student/bulk", json=batch, timeout=120)
+            response.raise_for_status()
+            inserted += response.json()["inserted"]
+        return inserted
+
+    def operations(self) -> Dict[str, Callable[[httpx.AsyncClient], Any]]:
+        api = self.args.api_url
+        web = self.args.web_url
+
+        def list_page(client):
+            # First page most of the time, otherwise start after a random seeded id
+            params = {"limit": 50}
+            if self.args.seed and random.random() < 0.5:
+                after = random.randint(self.args.id_base, self.seeded_max)
+                params["cursor"] = encode_cursor(after)
+            return client.get(f"{api}/student/list", params=params)
+
+        return {
+            "api_all": lambda client: client.get(f"{api}/student/all"),
+            "api_all_with_cache_info": lambda client: client.get(f"{api}/student/all/with-cache-info"),
+            "api_list": list_page,
+            "api_add": lambda client: client.post(f"{api}/student/add", json=self.random_student(next(self.next_id))),
+            "api_cache_clear": lambda client: client.delete(f"{api}/student/cache/clear"),
+            "web_all": lambda client: client.get(f"{web}/app/all"),
+            "web_index": lambda client: client.get(f"{web}/app/"),
+            "web_add_form": lambda client: client.get(f"{web}/app/add"),
+        }
+
+    async def timed(self, client: httpx.AsyncClient, name: str, request: Callable):
+        start = time.perf_counter()
+        try:
+            response = await request(client)
+            status, ok = str(response.status_code), response.status_code < 400
+        except httpx.HTTPError as e:
+            status, ok = type(e).__name__, False
+        self.recorder.record(name, (time.perf_counter() - start) * 1000, status, ok)
+
+    async def worker(self, client: httpx.AsyncClient, stop_at: float, weights: Dict[str, int]):
+        operations = self.operations()
+        names = list(weights)
+        cumulative = list(itertools.accumulate(weights[n] for n in names))
+        while time.perf_counter() < stop_at:
+            name = random.choices(names, cum_weights=cumulative)[0]
+            await self.timed(client, name, operations[name])
+
+    async def cache_clearer(self, client: httpx.AsyncClient, stop_at: float):
+        clear = self.operations()["api_cache_clear"]
+        while time.perf_counter() < stop_at:
+            await self.timed(client, "api_cache_clear", clear)
+            await asyncio.sleep(self.args.clear_interval)
+
+    async def run(self) -> Dict[str, Any]:
+        limits = httpx.Limits(max_connections=self.args.concurrency + 1,
+                              max_keepalive_connections=self.args.concurrency + 1)
+        async with httpx.AsyncClient(limits=limits, timeout=self.args.timeout) as client:
+            seeded = await self.seed(client) if self.args.seed else 0
+
+            weights = SCENARIOS[self.args.scenario]
+            started_at = time.time()
+            start = time.perf_counter()
+            stop_at = start + self.args.duration
+            tasks = [self.worker(client, stop_at, weights) for _ in range(self.args.concurrency)]
+            if self.args.scenario in ("clear-storm", "mixed"):
+                tasks.append(self.cache_clearer(client, stop_at))
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - start
+
+        report = {
+            "meta": {
+                "scenario": self.args.scenario,
+                "commit": git_commit(),
+                "started_at": started_at,
+                "duration_seconds": round(elapsed, 2),
+                "concurrency": self.args.concurrency,
+                "seeded_students": seeded,
+                "id_base": self.args.id_base,
+                "api_url": self.args.api_url,
+                "web_url": self.args.web_url
+            }
+        }
+        report.update(self.recorder.summary(elapsed))
+        return report
+
+
+def print_report(report: Dict[str, Any]):
+    meta = report["meta"]
+    print(f"scenario={meta['scenario']} commit={meta['commit']} duration={meta['duration_seconds']}s "
+          f"concurrency={meta['concurrency']} seeded={meta['seeded_students']}")
+    print(f"{'endpoint':<26}{'reqs':>8}{'errors':>8}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+    rows = list(report["endpoints"].items()) + [("TOTAL", report["totals"])]
+    for name, stats in rows:
+        print(f"{name:<26}{stats['requests']:>8}{stats['errors']:>8}{stats['throughput_rps']:>10}"
+              f"{_ms(stats['p50_ms']):>10}{_ms(stats['p95_ms']):>10}{_ms(stats['p99_ms']):>10}")
+
+
+def _ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.1f}ms"
+
+
+def compare(before_path: str, after_path: str):
+    """Print per-endpoint changes between two reports"""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{before['meta']['commit']} -> {after['meta']['commit']} "
+          f"({before['meta']['scenario']} -> {after['meta']['scenario']})")
+    print(f"{'endpoint':<26}{'metric':<16}{'before':>12}{'after':>12}{'change':>10}")
+    names = sorted(set(before["endpoints"]) | set(after["endpoints"])) + ["TOTAL"]
+    for name in names:
+        old = before["totals"] if name == "TOTAL" else before["endpoints"].get(name)
+        new = after["totals"] if name == "TOTAL" else after["endpoints"].get(name)
+        if not old or not new:
+            print(f"{name:<26}only in {'after' if new else 'before'}")
+            continue
+        for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            change = _change(old[metric], new[metric])
+            print(f"{name:<26}{metric:<16}{old[metric]!s:>12}{new[metric]!s:>12}{change:>10}")
+
+
+def _change(old: Optional[float], new: Optional[float]) -> str:
+    if not old or new is None:
+        return "-"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def parse_args(argv: List[str]):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="read")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of measured load")
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent workers")
+    parser.add_argument("--seed", type=int, default=0, help="students to insert before measuring")
+    parser.add_argument("--id-base", type=int, default=default_id_base(),
+                        help="first student_id used for seeded and written students")
+    parser.add_argument("--clear-interval", type=float, default=0.5,
+                        help="seconds between cache clears in clear-storm and mixed")
+    parser.add_argument("--timeout", type=float, default=30, help="per-request timeout in seconds")
+    parser.add_argument("--api-url", default="http://localhost/api", help="API base URL (through Traefik)")
+    parser.add_argument("--web-url", default="http://localhost", help="web-app base URL (through Traefik)")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two reports and exit")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]):
+    args = parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = asyncio.run(LoadTest(args).run())
+    print_report(report)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
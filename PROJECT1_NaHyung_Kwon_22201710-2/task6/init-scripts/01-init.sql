@@ -9,6 +9,18 @@ CREATE TABLE IF NOT EXISTS students (
 -- Create index on module_code
 CREATE INDEX IF NOT EXISTS idx_students_module_code ON students(module_code);
 
+-- Trigram indexes for case-insensitive name search (/student/search)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_students_first_name_trgm ON students USING gin (first_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_students_last_name_trgm ON students USING gin (last_name gin_trgm_ops);
+
+-- Students per module, maintained by the API on every insert
+CREATE TABLE IF NOT EXISTS module_stats (
+    module_code VARCHAR(10) PRIMARY KEY,
+    student_count INTEGER NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
 -- Insert initial student data
 INSERT INTO students (student_id, first_name, last_name, module_code) VALUES
 (1, 'John', 'Doe', 'COMP30520'),
@@ -16,4 +28,9 @@ INSERT INTO students (student_id, first_name, last_name, module_code) VALUES
 (3, 'Bob', 'Johnson', 'COMP30670'),
 (4, 'Alice', 'Brown', 'COMP30520'),
 (5, 'Charlie', 'Wilson', 'COMP30670')
-ON CONFLICT (student_id) DO NOTHING;
\ No newline at end of file
+ON CONFLICT (student_id) DO NOTHING;
+
+-- Count the seed rows; the API keeps the table current from here on
+INSERT INTO module_stats (module_code, student_count)
+SELECT module_code, COUNT(*) FROM students GROUP BY module_code
+ON CONFLICT (module_code) DO UPDATE SET student_count = EXCLUDED.student_count, updated_at = now();
\ No newline at end of file
@@ -0,0 +1,3 @@
+#!/bin/sh
+# Let database-replica stream WAL from this primary with the normal credentials
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
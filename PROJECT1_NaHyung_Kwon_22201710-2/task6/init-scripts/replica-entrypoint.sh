@@ -0,0 +1,22 @@
+#!/bin/sh
+# Start a hot standby of the `database` service, cloning it on first boot
+set -e
+
+if [ "$(id -u)" = "0" ]; then
+    mkdir -p "$PGDATA"
+    chown -R postgres:postgres "$PGDATA"
+    chmod 700 "$PGDATA"
+    exec su-exec postgres "$0" "$@"
+fi
+
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+    export PGPASSWORD="$POSTGRES_PASSWORD"
+    # -R writes standby.signal and primary_conninfo so postgres starts as a replica
+    until pg_basebackup -h database -U "$POSTGRES_USER" -D "$PGDATA" -X stream -R; do
+        echo "Waiting for primary to accept replication connections..."
+        rm -rf "${PGDATA:?}"/*
+        sleep 2
+    done
+fi
+
+exec postgres -c hot_standby=on
@@ -0,0 +1,86 @@
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.util.retry import Retry
+from prometheus_client import Counter, Gauge, Histogram
+import requests
+import time
+import os
+
+# Pool / retry tuning for calls to the API
+POOL_CONNECTIONS = int(os.getenv("API_POOL_CONNECTIONS", "4"))    # distinct hosts kept pooled
+POOL_MAXSIZE = int(os.getenv("API_POOL_MAXSIZE", "20"))           # keep-alive connections per host
+POOL_BLOCK = os.getenv("API_POOL_BLOCK", "false").lower() == "true"
+RETRY_TOTAL = int(os.getenv("API_RETRY_TOTAL", "2"))
+RETRY_BACKOFF = float(os.getenv("API_RETRY_BACKOFF_SECONDS", "0.2"))
+RETRY_STATUSES = (502, 503, 504)
+
+# Pool metrics; gauges sum across gunicorn workers that are still alive
+CONNECT_TIME = Histogram('api_client_connect_seconds', 'Time spent opening TCP connections to the API',
+                         buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+POOL_CONNECTIONS_OPENED = Counter('api_client_pool_connections', 'Connections opened by the pool', ['host'])
+POOL_REQUESTS = Counter('api_client_pool_requests', 'Requests sent through the pool', ['host'])
+POOL_IN_USE = Gauge('api_client_pool_in_use', 'Connections checked out of the pool', ['host'],
+                    multiprocess_mode='livesum')
+POOL_IDLE = Gauge('api_client_pool_idle', 'Open keep-alive connections waiting in the pool', ['host'],
+                  multiprocess_mode='livesum')
+POOL_MAX_SIZE = Gauge('api_client_pool_max_size', 'Keep-alive connection capacity per API host, summed over workers',
+                      multiprocess_mode='livesum')
+POOL_MAX_SIZE.set(POOL_MAXSIZE)
+
+class TimedHTTPConnection(HTTPConnection):
+    """HTTPConnection that records how long each new TCP connect takes"""
+    def connect(self):
+        start_time = time.perf_counter()
+        super().connect()
+        CONNECT_TIME.observe(time.perf_counter() - start_time)
+        POOL_CONNECTIONS_OPENED.labels(host=f"{self.host}:{self.port}").inc()
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose plain-HTTP pools use TimedHTTPConnection"""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            **self.poolmanager.pool_classes_by_scheme,
+            'http': TimedHTTPConnectionPool
+        }
+
+def record_pool_usage(response, *args, **kwargs):
+    """Response hook that refreshes the pool gauges for the host just used"""
+    pool = getattr(response.raw, '_pool', None)
+    if pool is None or pool.pool is None:
+        return response
+    host = f"{pool.host}:{pool.port}"
+    # The queue holds idle connections plus None slots for ones not opened yet
+    queued = list(pool.pool.queue)
+    POOL_IN_USE.labels(host=host).set(pool.pool.maxsize - len(queued))
+    POOL_IDLE.labels(host=host).set(sum(1 for conn in queued if conn is not None))
+    POOL_REQUESTS.labels(host=host).inc()
+    return response
+
+def create_session():
+    """Shared session so page views reuse keep-alive connections to the API"""
+    retry = Retry(
+        total=RETRY_TOTAL,
+        connect=RETRY_TOTAL,
+        read=0,  # a read timeout may mean the API already did the work
+        status_forcelist=RETRY_STATUSES,
+        backoff_factor=RETRY_BACKOFF,
+        raise_on_status=False
+    )
+    adapter = TimedHTTPAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        pool_block=POOL_BLOCK,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.hooks['response'].append(record_pool_usage)
+    return session
+
+api_session = create_session()
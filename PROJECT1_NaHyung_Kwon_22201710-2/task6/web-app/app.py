@@ -1,4 +1,10 @@
-from flask import Flask, render_template, request, redirect, url_for, session
+from flask import Flask, make_response, render_template, request, redirect, url_for, session
+from flask_compress import Compress
+from prometheus_client import generate_latest, CollectorRegistry, Counter, REGISTRY
+from prometheus_client import multiprocess
+from api_client import api_session
+from fragment_cache import fragment_cache, FRAGMENT_HITS, FRAGMENT_MISSES
+import hashlib
 import requests
 import time
 import os
@@ -21,30 +27,45 @@ app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY')
 app.wsgi_app = PrefixMiddleware(app.wsgi_app, prefix='/app')
 
-# Simple metrics storage with endpoint tracking
-metrics_data = {
-    'requests': {},  # Will store {"endpoint_method": count}
-    'uptime_start': time.time()
-}
+# Compress rendered roster pages for browsers; small pages are not worth the CPU
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+app.config['COMPRESS_BR_LEVEL'] = int(os.getenv('COMPRESS_BROTLI_QUALITY', '5'))
+app.config['COMPRESS_LEVEL'] = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+Compress(app)
+
+# Request counts live in prometheus_client so gunicorn workers can share them
+REQUEST_COUNT = Counter('request_count', 'Total number of requests', ['endpoint', 'method'])
+# gunicorn sets this once in the master so every worker reports the same uptime
+UPTIME_START = float(os.getenv('FRONTEND_STARTED_AT', time.time()))
 
 API_URL_ADD = "http://api:8080/student/add"
+API_URL_BULK = "http://api:8080/student/bulk"
 API_URL_ALL = "http://api:8080/student/all"
 API_URL_ALL_WITH_CACHE = "http://api:8080/student/all/with-cache-info"
+API_URL_LIST = "http://api:8080/student/list"
+API_URL_SEARCH = "http://api:8080/student/search"
 API_URL_CLEAR_CACHE = "http://api:8080/student/cache/clear"
 
+# /all renders one keyset page at a time; the API caps limit at 500
+PAGE_SIZE = int(os.getenv('WEB_PAGE_SIZE', '50'))
+MAX_PAGE_SIZE = 500
+PAGE_SIZE_CHOICES = [25, 50, 100, 200]
+
 def increment_request_count(endpoint, method="GET"):
     """Increment request count for specific endpoint and method"""
-    key = f"{endpoint}_{method}"
-    if key not in metrics_data['requests']:
-        metrics_data['requests'][key] = 0
-    metrics_data['requests'][key] += 1
+    REQUEST_COUNT.labels(endpoint=endpoint, method=method).inc()
 
 @app.after_request
 def add_security_headers(response):
     """Add security and caching headers to all responses"""
     # Prevent caching issues that might cause CSS problems
     if request.endpoint and request.endpoint not in ['health_check', 'metrics']:
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+        # Responses with a validator may be kept, but only reused after a 304
+        if response.get_etag()[0]:
+            response.headers['Cache-Control'] = 'private, no-cache'
+        else:
+            response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
         response.headers['Pragma'] = 'no-cache'
         response.headers['Expires'] = '0'
     
@@ -65,17 +86,16 @@ def health_check():
 @app.route("/metrics")
 def metrics():
     """Prometheus-style metrics endpoint with proper labels"""
-    uptime = time.time() - metrics_data['uptime_start']
-    
-    metrics_output = """# HELP request_count_total Total number of requests
-# TYPE request_count_total counter
-"""
+    uptime = time.time() - UPTIME_START
+
+    # Under gunicorn each worker keeps its own samples; merge them from disk
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    metrics_output = generate_latest(registry).decode()
 
-    # Add request_count_total metrics with endpoint and method labels
-    for key, count in metrics_data['requests'].items():
-        endpoint, method = key.rsplit('_', 1)
-        metrics_output += f'request_count_total{{endpoint="{endpoint}",method="{method}"}} {count}\n'
-    
     # Add other metrics
     metrics_output += f"""# HELP frontend_uptime_seconds Uptime in seconds
 # TYPE frontend_uptime_seconds gauge
@@ -110,10 +130,14 @@ def add_student():
             "module_code": module_code,
         }
         try:
-            response = requests.post(API_URL_ADD, json=payload, timeout=5)
+            response = api_session.post(API_URL_ADD, json=payload, timeout=5)
             if response.status_code == 200:
                 session['last_action'] = 'add_success'
                 return redirect(url_for("add_student"))
+            elif response.status_code == 202:
+                # Queued for the ingest worker; duplicates surface later as dead letters
+                session['last_action'] = 'add_queued'
+                return redirect(url_for("add_student"))
             else:
                 session['last_action'] = 'add_error'
                 return redirect(url_for("add_student"))
@@ -125,27 +149,147 @@ def add_student():
     session.pop('last_action', None)  # Clear after reading
     return render_template("form.html", last_action=last_action)
 
+@app.route("/bulk", methods=["GET", "POST"])
+def bulk_upload():
+    increment_request_count("/bulk", request.method)
+    session['last_visit'] = time.time()
+
+    result = None
+    error = None
+    if request.method == "POST":
+        upload = request.files.get("file")
+        if not upload or not upload.filename:
+            error = "Please choose a CSV or JSON file to upload."
+        else:
+            content_type = "application/json" if upload.filename.lower().endswith(".json") else "text/csv"
+            try:
+                response = api_session.post(API_URL_BULK, data=upload.read(),
+                                         headers={"Content-Type": content_type}, timeout=60)
+                if response.status_code == 200:
+                    result = response.json()
+                else:
+                    error = f"API returned status {response.status_code}: {response.text}"
+            except requests.exceptions.RequestException:
+                error = "API service unavailable. Please try again later."
+
+    return render_template("bulk.html", result=result, error=error)
+
+def page_params():
+    """Page size, module filter and cursor from the query string"""
+    limit = request.args.get('limit', PAGE_SIZE, type=int)
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    module_code = request.args.get('module_code', '').strip() or None
+    cursor = request.args.get('cursor') or None
+    return limit, module_code, cursor
+
+def fetch_student_rows(limit, module_code, cursor):
+    """Rendered table rows for one page, re-rendered only when the roster changed.
+
+    The cached fragment carries the API's ETag (the roster version); a 304
+    for it means the HTML is still current. Returns (fragment, cache_info),
+    or (None, error message).
+    """
+    key = ('student_rows', module_code, cursor, limit)
+    fragment = fragment_cache.get(key)
+    params = {'limit': limit}
+    if module_code:
+        params['module_code'] = module_code
+    if cursor:
+        params['cursor'] = cursor
+    headers = {'If-None-Match': fragment['version']} if fragment else {}
+
+    start_time = time.time()
+    response = api_session.get(API_URL_LIST, params=params, headers=headers, timeout=5)
+    response_time_ms = round((time.time() - start_time) * 1000, 2)
+    if response.status_code == 304 and fragment:
+        # Nothing changed since we rendered it; skip JSON parsing and Jinja
+        FRAGMENT_HITS.labels(fragment='student_rows').inc()
+        return fragment, {
+            'status': 'hit',
+            'source': 'local',
+            'last_modified': fragment['last_modified'],
+            'response_time_ms': response_time_ms
+        }
+    if response.status_code != 200:
+        return None, f"Failed to retrieve data. Status code: {response.status_code}"
+
+    FRAGMENT_MISSES.labels(fragment='student_rows').inc()
+    data = response.json()
+    students = data.get('data', [])
+    html = render_template("student_rows.html", students=students)
+    fragment = {
+        'version': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'html': html,
+        'etag': hashlib.md5(html.encode()).hexdigest(),
+        'count': len(students),
+        'next_cursor': data.get('next_cursor')
+    }
+    if fragment['version']:
+        fragment_cache.set(key, fragment)
+    hit = response.headers.get('X-Cache') == 'hit'
+    return fragment, {
+        'status': 'hit' if hit else 'miss',
+        'source': 'redis' if hit else 'database',
+        'response_time_ms': response_time_ms
+    }
+
 @app.route("/all")
 def get_all_students():
     increment_request_count("/all", "GET")
     session['last_visit'] = time.time()
+    limit, module_code, cursor = page_params()
+    try:
+        fragment, cache_info = fetch_student_rows(limit, module_code, cursor)
+    except requests.exceptions.RequestException:
+        return "API service unavailable"
+    if fragment is None:
+        return cache_info
+    return render_template("students.html", rows=fragment['html'], count=fragment['count'],
+                           next_cursor=fragment['next_cursor'], cache_info=cache_info, limit=limit,
+                           module_code=module_code or '', page_size_choices=PAGE_SIZE_CHOICES,
+                           continued=cursor is not None)
+
+@app.route("/all/rows")
+def get_student_rows():
+    """Table rows for the next page, appended by the /all page as it scrolls"""
+    increment_request_count("/all/rows", "GET")
+    limit, module_code, cursor = page_params()
     try:
-        response = requests.get(API_URL_ALL_WITH_CACHE, timeout=5)
+        fragment, error = fetch_student_rows(limit, module_code, cursor)
+    except requests.exceptions.RequestException:
+        return "API service unavailable", 503
+    if fragment is None:
+        return error, 502
+    response = make_response(fragment['html'])
+    response.headers['X-Next-Cursor'] = fragment['next_cursor'] or ''
+    response.headers['X-Row-Count'] = str(fragment['count'])
+    # Lets the browser revalidate a page of rows it already holds
+    response.set_etag(fragment['etag'])
+    return response.make_conditional(request)
+
+@app.route("/search")
+def search_students():
+    """Autocomplete results for the search box, proxied from the API"""
+    increment_request_count("/search", "GET")
+    query = request.args.get('q', '').strip()
+    # The API needs 3 characters to use its trigram indexes
+    if len(query) < 3:
+        return {"success": True, "data": []}
+    try:
+        response = api_session.get(API_URL_SEARCH, params={'q': query[:50], 'limit': 10}, timeout=5)
         if response.status_code == 200:
-            data = response.json()
-            students = data.get('data', [])
-            cache_info = data.get('cache_info', {})
-            return render_template("students.html", students=students, cache_info=cache_info)
+            return {"success": True, "data": response.json()}
         else:
-            return f"Failed to retrieve data. Status code: {response.status_code}"
+            return {"success": False, "error": f"API returned status {response.status_code}"}, 502
     except requests.exceptions.RequestException:
-        return "API service unavailable"
+        return {"success": False, "error": "API service unavailable"}, 503
 
 @app.route("/clear-cache", methods=["DELETE"])
 def clear_cache():
     increment_request_count("/clear-cache", "DELETE")
     try:
-        response = requests.delete(API_URL_CLEAR_CACHE, timeout=5)
+        response = api_session.delete(API_URL_CLEAR_CACHE, timeout=5)
         if response.status_code == 200:
             return response.json()
         else:
@@ -0,0 +1,63 @@
+from collections import OrderedDict
+from prometheus_client import Counter
+import threading
+import time
+import os
+
+# Rendered-fragment cache settings, per worker process
+FRAGMENT_CACHE_MAX_BYTES = int(os.getenv("WEB_FRAGMENT_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+FRAGMENT_CACHE_TTL = float(os.getenv("WEB_FRAGMENT_CACHE_TTL_SECONDS", "300"))
+
+FRAGMENT_HITS = Counter('fragment_cache_hits', 'Rendered fragments reused after the API answered 304', ['fragment'])
+FRAGMENT_MISSES = Counter('fragment_cache_misses', 'Fragments rendered because none was cached or the roster changed',
+                          ['fragment'])
+FRAGMENT_EVICTIONS = Counter('fragment_cache_evictions', 'Fragments evicted to stay within the byte budget',
+                             ['fragment'])
+
+class FragmentCache:
+    """LRU of rendered HTML fragments, each tagged with the roster version it was built from.
+
+    Entries are looked up by filter parameters and only reused while the API
+    confirms (304) that the version is still current, so a new insert shows
+    up on the very next view. The TTL and byte budget keep memory bounded.
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()  # key -> (fragment dict, size, expires_at)
+        self._lock = threading.Lock()  # gunicorn gthread workers serve several requests at once
+
+    def get(self, key):
+        """Return the fragment dict for a live entry, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= time.time():
+                self._delete(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, fragment):
+        """Store fragment, whose 'html' and 'version' keys are required"""
+        size = len(fragment['html'])
+        with self._lock:
+            self._delete(key)
+            if size > self.max_bytes or self.ttl <= 0:
+                return
+            self._entries[key] = (fragment, size, time.time() + self.ttl)
+            self.size += size
+            while self.size > self.max_bytes:
+                evicted_key, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                FRAGMENT_EVICTIONS.labels(fragment=evicted_key[0]).inc()
+
+    def _delete(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+fragment_cache = FragmentCache(FRAGMENT_CACHE_MAX_BYTES, FRAGMENT_CACHE_TTL)
@@ -0,0 +1,34 @@
+"""Gunicorn settings for serving the Flask web-app with threaded workers"""
+import os
+
+# Every worker writes its metric samples here so /metrics can merge them.
+# Must be set before prometheus_client is imported anywhere in the master.
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus-web")
+
+from prometheus_client import multiprocess  # noqa: E402
+import multiprocessing
+import shutil
+import time
+
+bind = f"0.0.0.0:{os.getenv('WEB_PORT', '5000')}"
+worker_class = "gthread"
+workers = int(os.getenv("WEB_WORKERS", str(multiprocessing.cpu_count() + 1)))
+threads = int(os.getenv("WEB_THREADS", "4"))
+keepalive = int(os.getenv("WEB_KEEPALIVE_SECONDS", "5"))
+backlog = int(os.getenv("WEB_BACKLOG", "2048"))
+timeout = int(os.getenv("WEB_TIMEOUT_SECONDS", "90"))  # /bulk forwards uploads with a 60s API timeout
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT_SECONDS", "30"))
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("WEB_MAX_REQUESTS_JITTER", "1000"))
+accesslog = None
+errorlog = "-"
+
+def on_starting(server):
+    # Samples from a previous run would otherwise be added to the new ones
+    shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+    # Uptime is reported for the whole server, not for whichever worker answers
+    os.environ["FRONTEND_STARTED_AT"] = str(time.time())
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)